@@ -0,0 +1,158 @@
+import asyncio
+import time
+from collections import Counter, deque
+from typing import Dict, List, Optional, Tuple
+
+BUCKET_SWEEP_INTERVAL = 30.0
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def full(self) -> bool:
+        self._refill()
+        return self._tokens >= self.burst
+
+    def delay_until(self, level: float = 0.0) -> float:
+        self._refill()
+        return max((level - self._tokens) / self.rate, 0.0)
+
+    def take(self, amount: int) -> float:
+        self._refill()
+        self._tokens -= amount
+        return max(-self._tokens / self.rate, 0.0)
+
+
+class RateMeter:
+    def __init__(self, window: float = 5.0, resolution: float = 0.25):
+        self.window = window
+        self.resolution = resolution
+        self.total = 0
+        self._slots: "deque[Tuple[float, int]]" = deque()
+
+    def _trim(self, now: float):
+        while self._slots and self._slots[0][0] <= now - self.window:
+            self._slots.popleft()
+
+    def add(self, amount: int):
+        now = time.monotonic()
+        self.total += amount
+        slot = now - now % self.resolution
+        if self._slots and self._slots[-1][0] == slot:
+            self._slots[-1] = (slot, self._slots[-1][1] + amount)
+        else:
+            self._slots.append((slot, amount))
+        self._trim(now)
+
+    @property
+    def rate(self) -> float:
+        self._trim(time.monotonic())
+        return sum(amount for _, amount in self._slots) / self.window
+
+
+class Flow:
+    __slots__ = ('ip', 'file_key', 'kind', 'bulk')
+
+    def __init__(self, ip: str, file_key: str, kind: str, bulk: bool):
+        self.ip = ip
+        self.file_key = file_key
+        self.kind = kind
+        self.bulk = bulk
+
+
+class BandwidthShaper:
+    def __init__(self, rate: float = 0, per_ip_rate: float = 0, per_file_rate: float = 0,
+                 max_connections_per_ip: int = 0):
+        self.max_connections_per_ip = max_connections_per_ip
+        self.per_ip_rate = per_ip_rate
+        self.per_file_rate = per_file_rate
+        self._global = TokenBucket(rate) if rate else None
+        self._ip_buckets: Dict[str, TokenBucket] = {}
+        self._file_buckets: Dict[str, TokenBucket] = {}
+        self._connections: Counter = Counter()
+        self._file_flows: Counter = Counter()
+        self._interactive = 0
+        self.meter = RateMeter()
+        self._kind_meters: Dict[str, RateMeter] = {}
+        self._ip_meters: Dict[str, RateMeter] = {}
+        self.rejected = 0
+        self._last_sweep = time.monotonic()
+
+    @property
+    def connections(self) -> int:
+        return sum(list(self._connections.values()))
+
+    def open(self, ip: str, file_key: str, kind: str, bulk: bool = False) -> Optional[Flow]:
+        if self.max_connections_per_ip and self._connections[ip] >= self.max_connections_per_ip:
+            self.rejected += 1
+            return None
+        self._sweep()
+        self._connections[ip] += 1
+        self._file_flows[file_key] += 1
+        self._interactive += not bulk
+        if self.per_ip_rate and ip not in self._ip_buckets:
+            self._ip_buckets[ip] = TokenBucket(self.per_ip_rate)
+        if self.per_file_rate and file_key not in self._file_buckets:
+            self._file_buckets[file_key] = TokenBucket(self.per_file_rate)
+        self._ip_meters.setdefault(ip, RateMeter())
+        return Flow(ip, file_key, kind, bulk)
+
+    def close(self, flow: Flow):
+        self._interactive -= not flow.bulk
+        self._connections[flow.ip] -= 1
+        if self._connections[flow.ip] <= 0:
+            del self._connections[flow.ip]
+            self._ip_meters.pop(flow.ip, None)
+        self._file_flows[flow.file_key] -= 1
+        if self._file_flows[flow.file_key] <= 0:
+            del self._file_flows[flow.file_key]
+
+    def _sweep(self):
+        now = time.monotonic()
+        if now - self._last_sweep < BUCKET_SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        for buckets, active in ((self._ip_buckets, self._connections), (self._file_buckets, self._file_flows)):
+            for key in [key for key, bucket in buckets.items() if key not in active and bucket.full]:
+                del buckets[key]
+
+    async def throttle(self, flow: Flow, amount: int):
+        if self._global and flow.bulk:
+            while (delay := self._global.delay_until(self._global.burst / 2 if self._interactive else 0)) > 0:
+                await asyncio.sleep(delay)
+
+        delay = 0.0
+        for bucket in (self._global, self._ip_buckets.get(flow.ip), self._file_buckets.get(flow.file_key)):
+            if bucket:
+                delay = max(delay, bucket.take(amount))
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        self.meter.add(amount)
+        self._kind_meters.setdefault(flow.kind, RateMeter()).add(amount)
+        ip_meter = self._ip_meters.get(flow.ip)
+        if ip_meter:
+            ip_meter.add(amount)
+
+    def stats(self, top: int = 5) -> Dict[str, object]:
+        clients: List[Tuple[str, float]] = sorted(
+            ((ip, meter.rate) for ip, meter in list(self._ip_meters.items())), key=lambda item: item[1], reverse=True
+        )
+        return {
+            "bytes_per_second": self.meter.rate,
+            "bytes_served": self.meter.total,
+            "by_kind": {kind: meter.rate for kind, meter in list(self._kind_meters.items())},
+            "top_clients": clients[:top],
+            "connections": self.connections,
+            "rejected": self.rejected,
+        }
@@ -1,25 +1,79 @@
 import asyncio
+import hashlib
+import json
+import re
+import shutil
 import socket
+import time
+import uuid
+from contextlib import aclosing
 import discord
-import requests
 from discord import app_commands, ui
 from discord.ext import commands
 from dotenv import load_dotenv
 from pathlib import Path
 from os import getenv
 
-from downloader import YouTubeDownloader, format_duration, format_views, format_size
-from file_manager import FileManager
+from downloader import (
+    YouTubeDownloader, DownloadError, AUDIO_MODE_COPY, AUDIO_MODE_MP3, VIDEO_HEIGHTS, Clip, extract_video_id, format_key,
+    estimate_size, pick_video_height, is_progressive, make_clip, format_duration, format_views, format_size
+)
+from dislikes import DislikeClient
+from file_manager import FileManager, StorageQuotaError
 from file_server import FileServer
-from embed_builder import create_error_embed, create_processing_embed
+from inflight import InflightJob, SingleFlight
+from metrics import Metrics, StageTimer
+from progress import BatchProgress, EditPacer, ProgressPublisher, format_speed
+from scheduler import DownloadScheduler
+from embed_builder import (
+    create_batch_embed, create_error_embed, create_processing_embed, create_progress_embed, create_queued_embed,
+    create_success_embed
+)
 
 load_dotenv()
 
 DISCORD_TOKEN = getenv('DISCORD_TOKEN')
 FILE_SERVER_PORT = int(getenv('FILE_SERVER_PORT', '3000'))
+METRICS_PORT = int(getenv('METRICS_PORT', str(FILE_SERVER_PORT + 1)))
 DOWNLOAD_DIR = getenv('DOWNLOAD_DIR', './downloads')
 UPLOAD_DIR = getenv('UPLOAD_DIR', './uploads')
 FILE_EXPIRY_HOURS = int(getenv('FILE_EXPIRY_HOURS', '24'))
+STORAGE_MAX_MB = int(getenv('STORAGE_MAX_MB', '0'))
+STORAGE_MAX_FILES = int(getenv('STORAGE_MAX_FILES', '0'))
+EXPIRY_CHECK_SECONDS = int(getenv('EXPIRY_CHECK_SECONDS', '5'))
+METADATA_BACKEND = getenv('METADATA_BACKEND', 'sqlite')
+FILE_SERVER_MODE = getenv('FILE_SERVER_MODE', 'loop')
+FILE_SERVER_WORKERS = int(getenv('FILE_SERVER_WORKERS', '2'))
+FILE_SERVER_RATE_MB = float(getenv('FILE_SERVER_RATE_MB', '0'))
+FILE_SERVER_RATE_PER_IP_MB = float(getenv('FILE_SERVER_RATE_PER_IP_MB', '0'))
+FILE_SERVER_RATE_PER_FILE_MB = float(getenv('FILE_SERVER_RATE_PER_FILE_MB', '0'))
+FILE_SERVER_MAX_CONNECTIONS_PER_IP = int(getenv('FILE_SERVER_MAX_CONNECTIONS_PER_IP', '0'))
+FILE_SERVER_ZIP_STREAMS = max(int(getenv('FILE_SERVER_ZIP_STREAMS', '2')), 1)
+YTDLP_ENGINE = getenv('YTDLP_ENGINE', 'subprocess')
+RYD_API_URL = getenv('RYD_API_URL', 'https://returnyoutubedislikeapi.com')
+PROGRESS_EDITS_PER_SECOND = float(getenv('PROGRESS_EDITS_PER_SECOND', '5'))
+PROGRESS_EDIT_INTERVAL = float(getenv('PROGRESS_EDIT_INTERVAL', '1.0'))
+PROGRESS_MIN_STEP = float(getenv('PROGRESS_MIN_STEP', '5'))
+PROGRESS_MIN_INTERVAL = float(getenv('PROGRESS_MIN_INTERVAL', '1.0'))
+MAX_CONCURRENT_DOWNLOADS = int(getenv('MAX_CONCURRENT_DOWNLOADS', '4'))
+MAX_AUDIO_DOWNLOADS = int(getenv('MAX_AUDIO_DOWNLOADS', '2'))
+MAX_VIDEO_DOWNLOADS = int(getenv('MAX_VIDEO_DOWNLOADS', '3'))
+MAX_DOWNLOADS_PER_USER = int(getenv('MAX_DOWNLOADS_PER_USER', '2'))
+MAX_DOWNLOADS_PER_GUILD = int(getenv('MAX_DOWNLOADS_PER_GUILD', '3'))
+MAX_QUEUE_SIZE = int(getenv('MAX_QUEUE_SIZE', '50'))
+MAX_DURATION_MINUTES = int(getenv('MAX_DURATION_MINUTES', '0'))
+MAX_VIDEO_SIZE_MB = int(getenv('MAX_VIDEO_SIZE_MB', '0'))
+PROBE_TTL_SECONDS = int(getenv('PROBE_TTL_SECONDS', '1800'))
+MAX_CONCURRENT_PROBES = max(int(getenv('MAX_CONCURRENT_PROBES', '4')), 1)
+AUDIO_MODE = getenv('AUDIO_MODE', AUDIO_MODE_MP3)
+PLAYLIST_MAX_ENTRIES = int(getenv('PLAYLIST_MAX_ENTRIES', '50'))
+PLAYLIST_WORKERS = max(int(getenv('PLAYLIST_WORKERS', '3')), 1)
+
+COMMAND_HASH_FILE = Path(getenv('COMMAND_HASH_FILE', str(Path(UPLOAD_DIR) / '.command_tree.sha256')))
+
+UNSAFE_FILENAME_RE = re.compile(r'[\\/:*?"<>|]')
+CARD_FIELDS = ('id', 'title', 'uploader', 'view_count', 'duration', 'like_count', 'thumbnail', 'height',
+               'section_start', 'section_end')
 
 
 def get_local_ip() -> str:
@@ -40,25 +94,15 @@ def get_server_domain() -> str:
     return domain
 
 
-def fetch_dislikes(video_id: str) -> int:
-    try:
-        resp = requests.get(
-            "https://returnyoutubedislikeapi.com/Votes",
-            params={"videoId": video_id},
-            timeout=5
-        )
-        if resp.ok:
-            return resp.json().get("dislikes", 0)
-    except Exception:
-        pass
-    return 0
-
-
-FILE_SERVER_DOMAIN = get_server_domain()
+def command_tree_hash(tree: app_commands.CommandTree, application_id: int) -> str:
+    payload = [command.to_dict(tree) for command in tree.get_commands()]
+    return hashlib.sha256(json.dumps([application_id, payload], sort_keys=True, default=str).encode()).hexdigest()
 
 
 class YouTubeBot(commands.Bot):
     def __init__(self):
+        self.startup_phases = {}
+        self._phase_mark = time.monotonic()
         super().__init__(
             command_prefix='!',
             intents=discord.Intents.default(),
@@ -66,19 +110,95 @@ class YouTubeBot(commands.Bot):
             allowed_installs=app_commands.AppInstallationType(guild=True, user=True),
             activity=discord.Activity(type=discord.ActivityType.watching, name="YouTube | /video /audio")
         )
-        self.downloader = YouTubeDownloader(DOWNLOAD_DIR)
-        self.file_manager = FileManager(UPLOAD_DIR, FILE_EXPIRY_HOURS)
-        self.file_server = FileServer(UPLOAD_DIR, FILE_SERVER_PORT, FILE_SERVER_DOMAIN)
+        self.downloader = YouTubeDownloader(
+            DOWNLOAD_DIR, engine=YTDLP_ENGINE,
+            progress_step=PROGRESS_MIN_STEP, progress_interval=PROGRESS_MIN_INTERVAL,
+            probe_ttl=PROBE_TTL_SECONDS, max_concurrent_probes=MAX_CONCURRENT_PROBES
+        )
+        self.metrics = Metrics()
+        self.file_manager = FileManager(
+            UPLOAD_DIR, FILE_EXPIRY_HOURS, METADATA_BACKEND, EXPIRY_CHECK_SECONDS,
+            max_bytes=STORAGE_MAX_MB * 1024 * 1024, max_files=STORAGE_MAX_FILES
+        )
+        self.file_server = FileServer(
+            UPLOAD_DIR, FILE_SERVER_PORT, get_server_domain, index=self.file_manager.index,
+            rate_limit=FILE_SERVER_RATE_MB * 1024 * 1024,
+            rate_limit_per_ip=FILE_SERVER_RATE_PER_IP_MB * 1024 * 1024,
+            rate_limit_per_file=FILE_SERVER_RATE_PER_FILE_MB * 1024 * 1024,
+            max_connections_per_ip=FILE_SERVER_MAX_CONNECTIONS_PER_IP, metrics=self.metrics,
+            metrics_port=METRICS_PORT, max_zip_streams=FILE_SERVER_ZIP_STREAMS
+        )
+        self.inflight = SingleFlight(
+            on_error=lambda e: self.metrics.inc("errors_total", error=type(e).__name__, command="job")
+        )
+        self.dislikes = DislikeClient(RYD_API_URL)
+        self.edit_pacer = EditPacer(rate=PROGRESS_EDITS_PER_SECOND, burst=max(int(PROGRESS_EDITS_PER_SECOND), 1))
+        self.scheduler = DownloadScheduler(
+            max_concurrent=MAX_CONCURRENT_DOWNLOADS,
+            kind_limits={"audio": MAX_AUDIO_DOWNLOADS, "video": MAX_VIDEO_DOWNLOADS},
+            max_per_user=MAX_DOWNLOADS_PER_USER,
+            max_per_guild=MAX_DOWNLOADS_PER_GUILD,
+            max_queue=MAX_QUEUE_SIZE
+        )
+        self.metrics.collect("active_jobs", lambda: self.scheduler.active)
+        self.metrics.collect("queue_depth", lambda: self.scheduler.queue_depth)
+        self.metrics.collect("files", lambda: len(self.file_manager.index))
+        self.metrics.collect("storage_bytes", lambda: self.file_manager.index.total_bytes)
+        self.metrics.collect("disk_free_bytes", lambda: shutil.disk_usage(UPLOAD_DIR).free)
+        self.metrics.collect("cache_hits_total", lambda: self.file_manager.cache_hits, kind="counter")
+        self.metrics.collect("cache_misses_total", lambda: self.file_manager.cache_misses, kind="counter")
+        self._phase("init")
+
+    def _phase(self, name: str):
+        now = time.monotonic()
+        self.startup_phases[name] = now - self._phase_mark
+        self._phase_mark = now
+
+    async def sync_commands(self):
+        tree_hash = command_tree_hash(self.tree, self.application_id)
+        try:
+            if COMMAND_HASH_FILE.read_text().strip() == tree_hash:
+                print(" Slash commands unchanged, skipping sync")
+                return
+        except OSError:
+            pass
+        await self.tree.sync()
+        COMMAND_HASH_FILE.write_text(tree_hash)
+        print(f" Synced {len(self.tree.get_commands())} slash commands")
+
+    @staticmethod
+    def _reconcile_done(future: asyncio.Future):
+        if not future.cancelled() and future.exception():
+            print(f" Upload store reconcile failed: {future.exception()!r}")
 
     async def setup_hook(self):
-        self.file_manager.clear_all_files()
-        self.file_server.start(threaded=True)
+        self._phase("login")
+        loop = asyncio.get_running_loop()
+        self._reconcile = loop.run_in_executor(None, self.file_manager.reconcile)
+        self._reconcile.add_done_callback(self._reconcile_done)
+        await loop.run_in_executor(None, self.file_manager.check_placement, DOWNLOAD_DIR)
+        self._phase("placement_check")
+        await self.file_server.start(FILE_SERVER_MODE, FILE_SERVER_WORKERS)
         self.file_manager.start_scheduler()
-        await self.tree.sync()
-        print(f" Synced {len(self.tree.get_commands())} slash commands")
+        loop.run_in_executor(None, self.downloader.warm)
+        self._phase("file_server")
+        await self.sync_commands()
+        self._phase("command_sync")
 
     async def on_ready(self):
-        pass
+        if "gateway" in self.startup_phases:
+            return
+        self._phase("gateway")
+        phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.startup_phases.items())
+        print(f" Ready in {sum(self.startup_phases.values()):.2f}s ({phases})")
+
+    async def close(self):
+        self.inflight.cancel_all()
+        await self.dislikes.close()
+        self.downloader.shutdown()
+        self.scheduler.shutdown()
+        await self.file_server.stop()
+        await super().close()
 
 
 bot = YouTubeBot()
@@ -95,157 +215,563 @@ def build_info_text(title: str, uploader: str, views: int, duration: int,
         text += f"\n\nvideo too large for discord preview, click **Stream** to watch >:("
     return text
 
-async def process_download(interaction: discord.Interaction, url: str, is_audio: bool, hidden: bool = False):
-    from embed_builder import create_progress_embed, create_success_embed
+def media_extension(is_audio: bool, file_info: dict = None) -> str:
+    if file_info and file_info.get('extension'):
+        return file_info['extension']
+    return ".mp3" if is_audio else ".mp4"
+
+
+def record_encode(event, timings: dict, audio_mode: str):
+    if event.postprocessor != "ExtractAudio":
+        return
+    if event.status == "started":
+        timings['started'] = time.monotonic()
+    elif event.status == "finished" and 'started' in timings:
+        elapsed = time.monotonic() - timings.pop('started')
+        bot.metrics.inc("audio_encode_seconds_total", elapsed, audio_mode=audio_mode)
+        bot.metrics.inc("audio_encodes_total", audio_mode=audio_mode)
+        print(f" Audio encode ({audio_mode}) took {elapsed:.2f}s")
+
+
+def format_rate(rate: float) -> str:
+    return format_speed(rate) if rate else "0 B/s"
+
+
+def clip_label(metadata: dict) -> str:
+    start, end = metadata.get('section_start'), metadata.get('section_end')
+    if start is None and end is None:
+        return ""
+    return f" • ✂️ {format_duration(start or 0)}–{format_duration(end) if end else 'end'}"
+
+
+def plan_download(info: dict, is_audio: bool, audio_mode: str = AUDIO_MODE_MP3, clip: Clip = None):
+    duration = info.get('duration') or 0
+    if clip and duration and clip.start >= duration:
+        raise DownloadError(f"The start time is past the end of the video ({format_duration(duration)})")
+    length = clip.length(duration) if clip else duration
+    if MAX_DURATION_MINUTES and length > MAX_DURATION_MINUTES * 60:
+        raise DownloadError(f"{'Clip' if clip else 'Video'} is too long ({format_duration(length)}), "
+                            f"the limit is {MAX_DURATION_MINUTES} minutes")
+
+    scale = length / duration if clip and duration else 1
+    max_height = VIDEO_HEIGHTS[0]
+    if not is_audio:
+        max_height = pick_video_height(info, int(MAX_VIDEO_SIZE_MB * 1024 * 1024 / scale) if scale else 0)
+        if max_height is None:
+            smallest = int(estimate_size(info, max_height=VIDEO_HEIGHTS[-1]) * scale)
+            raise DownloadError(f"Video is too large ({format_size(smallest)} at {VIDEO_HEIGHTS[-1]}p), "
+                                f"the limit is {MAX_VIDEO_SIZE_MB} MB")
+
+    estimated_bytes = int(estimate_size(info, is_audio, max_height, audio_mode) * scale)
+    bot.file_manager.check_quota(estimated_bytes)
+    return max_height, estimated_bytes
+
+
+def find_local_video(video_id: str):
+    found = bot.file_manager.find_video_file(video_id, [format_key(False, height) for height in VIDEO_HEIGHTS])
+    if found:
+        return found[0], found[1].get('video_info') or {}, "upload"
+    return None
+
+
+async def prepare_job(url: str, is_audio: bool, video_id: str = None, user_id: int = None, guild_id: int = None,
+                      audio_mode: str = AUDIO_MODE_MP3, clip: Clip = None):
+    mode = "audio" if is_audio else "video"
+    fmt = format_key(is_audio, audio_mode=audio_mode, clip=clip)
+    local = find_local_video(video_id) if is_audio and video_id else None
+    info = local[1] if local else None
+    max_height, estimated_bytes = VIDEO_HEIGHTS[0], 0
+
+    if not info:
+        bot.scheduler.check_capacity()
+        info = await bot.downloader.probe(url)
+        video_id = video_id or info.get('id')
+        max_height, estimated_bytes = plan_download(info, is_audio, audio_mode, clip)
+        if max_height != VIDEO_HEIGHTS[0]:
+            fmt = format_key(is_audio, max_height, clip=clip)
+            print(f" Downgrading {video_id} to {max_height}p (~{format_size(estimated_bytes)})")
+            file_uuid = bot.file_manager.find_cached(video_id, mode, fmt)
+            if file_uuid:
+                return video_id, fmt, file_uuid, info, None
+
+    if local:
+        print(f" Deriving audio for {video_id} from local {local[2]} copy")
+        factory = lambda job: run_derive_job(job, local[0], local[2], video_id, info, mode, fmt,
+                                             user_id, guild_id, audio_mode, clip)
+    else:
+        factory = lambda job: run_download_job(job, url, is_audio, mode, fmt, user_id, guild_id,
+                                               info=info, max_height=max_height, cost=estimated_bytes,
+                                               audio_mode=audio_mode, clip=clip)
+    return video_id, fmt, None, info, factory
+
+
+async def process_download(interaction: discord.Interaction, url: str, is_audio: bool, hidden: bool = False,
+                           audio_mode: str = AUDIO_MODE, start: str = None, end: str = None, accurate: bool = False):
     await interaction.response.defer(ephemeral=True)
 
     try:
-        progress_msg = await interaction.followup.send(embed=create_progress_embed(0, "...", "...", is_audio), ephemeral=True, wait=True)
+        mode = "audio" if is_audio else "video"
+        clip = make_clip(start, end, accurate)
+        fmt = format_key(is_audio, audio_mode=audio_mode, clip=clip)
+        video_id = extract_video_id(url)
+        file_uuid = None
+        progress_msg = None
+        if video_id:
+            bot.dislikes.prefetch(video_id)
+            file_uuid = bot.file_manager.find_cached(video_id, mode, fmt)
 
-        metadata = None
-        error_msg = None
-        last_update = -10
-        update_queue = asyncio.Queue()
+        if not file_uuid:
+            progress_msg = await interaction.followup.send(embed=create_progress_embed(0, "...", "...", is_audio), ephemeral=True, wait=True)
+
+            prefetched = bool(video_id)
+            video_id, fmt, file_uuid, info, factory = await prepare_job(
+                url, is_audio, video_id, interaction.user.id, interaction.guild_id, audio_mode, clip
+            )
+            if not prefetched and video_id:
+                bot.dislikes.prefetch(video_id)
+
+        bot.file_manager.record_lookup(bool(file_uuid))
+        if file_uuid:
+            metadata = bot.file_manager.get_file_info(file_uuid).get('video_info') or {}
+            if progress_msg:
+                await progress_msg.edit(embed=create_success_embed(is_audio))
+            else:
+                await interaction.followup.send(embed=create_success_embed(is_audio), ephemeral=True)
+            print(f" Cache hit for {mode}: {video_id} -> {file_uuid}")
+        else:
+            title, thumbnail = info.get('title'), info.get('thumbnail')
+            publisher = ProgressPublisher(progress_msg, bot.edit_pacer, PROGRESS_EDIT_INTERVAL)
+            publisher.publish(create_progress_embed(0, "...", "...", is_audio, title=title, thumbnail=thumbnail))
 
-        def run_download():
-            for update in bot.downloader.download_with_progress(url, is_audio):
-                asyncio.run_coroutine_threadsafe(update_queue.put(update), loop)
-            asyncio.run_coroutine_threadsafe(update_queue.put(None), loop)
+            job_key = bot.downloader.job_key(url, mode, fmt)
+            updates, attached = bot.inflight.join(job_key, factory)
+            if attached:
+                print(f" Attached to in-flight {mode} download: {url}")
 
-        loop = asyncio.get_event_loop()
-        loop.run_in_executor(None, run_download)
+            final_embed = None
+            stream_url = None
+            try:
+                while True:
+                    update = await updates.get()
+                    if update[0] == 'stream':
+                        stream_url = update[1]
+                    elif update[0] == 'queued':
+                        publisher.publish(create_queued_embed(update[1], is_audio, title=title, thumbnail=thumbnail))
+                    elif update[0] == 'progress':
+                        event = update[1]
+                        publisher.publish(create_progress_embed(
+                            event.percent if event.percent is not None else (0.0 if event.phase == "download" else 100.0),
+                            event.speed_str, event.eta_str, is_audio, phase=event.phase,
+                            title=title, thumbnail=thumbnail, stream_url=stream_url,
+                            transcoding=audio_mode != AUDIO_MODE_COPY
+                        ))
+                    elif update[0] == 'error':
+                        final_embed = create_error_embed(update[1], url)
+                        return
+                    elif update[0] == 'ready':
+                        _, metadata, file_uuid = update
+                        final_embed = create_success_embed(is_audio)
+                        break
+            finally:
+                bot.inflight.leave(job_key, updates)
+                await publisher.close(final_embed)
+
+        await send_result_card(interaction, metadata, video_id, file_uuid, is_audio, hidden)
+
+        print(f" Downloaded {mode}: {metadata.get('title', 'Unknown')} -> {file_uuid}")
 
-        while True:
-            update = await update_queue.get()
-            if update is None:
-                break
+    except Exception as e:
+        bot.metrics.inc("errors_total", error=type(e).__name__, command="audio" if is_audio else "video")
+        try:
+            await interaction.edit_original_response(embed=create_error_embed(str(e), url))
+        except:
+            await interaction.followup.send(embed=create_error_embed(str(e), url))
+
+
+async def run_download_job(job: InflightJob, url: str, is_audio: bool, mode: str, fmt: str,
+                           user_id: int = None, guild_id: int = None, info: dict = None,
+                           max_height: int = VIDEO_HEIGHTS[0], cost: int = 0, audio_mode: str = AUDIO_MODE_MP3,
+                           clip: Clip = None):
+    metadata = None
+    error_msg = None
+    file_uuid = str(uuid.uuid4())
+    growing = None
+    encode_timings = {}
+    stages = StageTimer(bot.metrics)
+
+    try:
+        stages.enter("queue_wait")
+        async with bot.scheduler.slot(mode, user_id, guild_id, on_position=lambda pos: job.publish(('queued', pos)), cost=cost):
+            started = time.monotonic()
+            stages.enter("ytdlp_startup")
+            async for update in bot.downloader.stream(url, mode, executor=bot.scheduler.executor,
+                                                      max_height=max_height, info=info, audio_mode=audio_mode,
+                                                      clip=clip):
+                if update[0] == 'progress':
+                    event = update[1]
+                    stages.enter("download" if event.phase == "download" else "postprocess")
+                    record_encode(event, encode_timings, audio_mode)
+                    if (growing is None and bot.file_server.live_registry
+                            and is_progressive(event.filename, is_audio, audio_mode)):
+                        growing = event.filename
+                        bot.file_server.register_growing(file_uuid, Path(growing), event.exact_total)
+                        ext = Path(growing).suffix.lower()
+                        job.publish(('stream', bot.file_server.get_file_url(file_uuid, extension=ext)))
+                    elif growing and event.filename == growing:
+                        bot.file_server.update_growing(file_uuid, event.exact_total)
+                    job.publish(update)
+                elif update[0] == 'done':
+                    metadata = update[1]
+                elif update[0] == 'error':
+                    error_msg = update[1]
+
+        if error_msg:
+            raise DownloadError(error_msg)
+        if not metadata:
+            raise DownloadError("Download failed - no metadata")
+        stages.stop()
+
+        metadata = {**(info or {}), **metadata}
+        if is_audio:
+            bot.metrics.inc("audio_jobs_total", source="network")
+            bot.metrics.inc("audio_network_seconds_total", time.monotonic() - started)
+            bot.metrics.inc("audio_network_media_seconds_total",
+                            clip.length(metadata.get('duration') or 0) if clip else metadata.get('duration') or 0)
+        return await store_result(metadata, is_audio, mode, fmt, file_uuid, clip)
+    finally:
+        bot.file_server.finish_growing(file_uuid)
+
+
+async def run_derive_job(job: InflightJob, source: Path, origin: str, video_id: str, info: dict,
+                         mode: str, fmt: str, user_id: int = None, guild_id: int = None,
+                         audio_mode: str = AUDIO_MODE_MP3, clip: Clip = None):
+    metadata = None
+    error_msg = None
+    encode_timings = {}
+    stages = StageTimer(bot.metrics)
+
+    stages.enter("queue_wait")
+    async with bot.scheduler.slot(mode, user_id, guild_id, on_position=lambda pos: job.publish(('queued', pos))):
+        started = time.monotonic()
+        stages.enter("derive")
+        async for update in bot.downloader.derive_audio(source, video_id, info, audio_mode, clip):
             if update[0] == 'progress':
-                _, percent, speed, eta = update
-                if percent - last_update >= 5 or percent >= 100:
-                    last_update = percent
-                    try:
-                        await progress_msg.edit(embed=create_progress_embed(percent, speed, eta, is_audio))
-                    except:
-                        pass
+                record_encode(update[1], encode_timings, audio_mode)
+                job.publish(update)
             elif update[0] == 'done':
                 metadata = update[1]
             elif update[0] == 'error':
                 error_msg = update[1]
+        elapsed = time.monotonic() - started
+
+    if error_msg:
+        raise DownloadError(error_msg)
+    stages.stop()
+
+    bot.metrics.inc("audio_jobs_total", source=origin)
+    bot.metrics.inc("audio_derive_seconds_total", elapsed)
+    media_seconds = bot.metrics.get("audio_network_media_seconds_total")
+    if media_seconds:
+        network_rate = bot.metrics.get("audio_network_seconds_total") / media_seconds
+        media_seconds = clip.length(metadata.get('duration') or 0) if clip else metadata.get('duration') or 0
+        saved = max(media_seconds * network_rate - elapsed, 0)
+        bot.metrics.inc("audio_derive_seconds_saved_total", saved)
+        print(f" Derived audio for {video_id} in {elapsed:.1f}s (~{saved:.0f}s saved)")
+    return await store_result(metadata, True, mode, fmt, str(uuid.uuid4()), clip)
+
+
+async def store_result(metadata: dict, is_audio: bool, mode: str, fmt: str, file_uuid: str, clip: Clip = None):
+    video_id = metadata.get('id', '')
+    file_path = bot.downloader.get_downloaded_file_path(video_id, is_audio=is_audio, metadata=metadata, clip=clip)
+    if not file_path:
+        raise DownloadError("Downloaded file not found")
 
-        if error_msg:
-            await progress_msg.edit(embed=create_error_embed(error_msg, url))
-            return
+    try:
+        with bot.metrics.timer("stage_seconds", stage="move"):
+            file_uuid = await asyncio.get_running_loop().run_in_executor(None, lambda: bot.file_manager.add_file(
+                file_path, file_path.name,
+                video_title=metadata.get('title', 'Unknown'),
+                video_id=video_id,
+                mode=mode,
+                format_key=fmt,
+                video_info={key: metadata.get(key) for key in CARD_FIELDS},
+                file_uuid=file_uuid
+            ))
+    except StorageQuotaError:
+        file_path.unlink(missing_ok=True)
+        raise
+    if not file_uuid:
+        raise DownloadError("Failed to process file")
+
+    return metadata, file_uuid
+
+
+async def fetch_entry(url: str, is_audio: bool, user_id: int = None, guild_id: int = None, on_progress=None,
+                      audio_mode: str = AUDIO_MODE_MP3):
+    mode = "audio" if is_audio else "video"
+    video_id = extract_video_id(url)
+    file_uuid = bot.file_manager.find_cached(video_id, mode, format_key(is_audio, audio_mode=audio_mode)) if video_id else None
+
+    if not file_uuid:
+        try:
+            video_id, fmt, file_uuid, info, factory = await prepare_job(url, is_audio, video_id, user_id, guild_id, audio_mode)
+        except Exception as e:
+            bot.metrics.inc("errors_total", error=type(e).__name__, command="playlist")
+            raise
 
-        if not metadata:
-            await progress_msg.edit(embed=create_error_embed("Download failed - no metadata", url))
-            return
+    bot.file_manager.record_lookup(bool(file_uuid))
+    if file_uuid:
+        return bot.file_manager.get_file_info(file_uuid).get('video_info') or {}, file_uuid, True
 
-        await progress_msg.edit(embed=create_success_embed(is_audio))
+    job_key = bot.downloader.job_key(url, mode, fmt)
+    updates, _ = bot.inflight.join(job_key, factory)
+    try:
+        while True:
+            update = await updates.get()
+            if update[0] == 'progress' and on_progress:
+                on_progress(update[1])
+            elif update[0] == 'error':
+                raise DownloadError(update[1])
+            elif update[0] == 'ready':
+                return update[1], update[2], False
+    finally:
+        bot.inflight.leave(job_key, updates)
 
-        video_id = metadata.get('id', '')
-        file_path = bot.downloader.get_downloaded_file_path(video_id, is_audio=is_audio)
 
-        if not file_path:
-            await interaction.followup.send(embed=create_error_embed("Downloaded file not found", url), ephemeral=True)
-            return
+async def process_batch(interaction: discord.Interaction, urls: list, is_audio: bool,
+                        make_zip: bool = False, hidden: bool = False, audio_mode: str = AUDIO_MODE):
+    await interaction.response.defer(ephemeral=True)
+    batch = BatchProgress()
 
-        file_uuid = bot.file_manager.add_file(
-            file_path, file_path.name,
-            video_title=metadata.get('title', 'Unknown'),
-            video_id=video_id
-        )
+    def render():
+        return create_batch_embed(batch.title, batch.completed, batch.total, batch.failed, batch.cached,
+                                  format_speed(batch.speed), is_audio, batch.expanding)
 
-        if not file_uuid:
-            await interaction.followup.send(embed=create_error_embed("Failed to process file", url), ephemeral=True)
-            return
+    progress_msg = await interaction.followup.send(embed=render(), ephemeral=True, wait=True)
+    publisher = ProgressPublisher(progress_msg, bot.edit_pacer, PROGRESS_EDIT_INTERVAL)
+    entries: asyncio.Queue = asyncio.Queue(maxsize=PLAYLIST_WORKERS)
 
-        ext = ".mp3" if is_audio else ".mp4"
-        file_info = bot.file_manager.get_file_info(file_uuid)
-        file_url = bot.file_server.get_file_url(file_uuid, download=False, extension=ext)
-        download_url = bot.file_server.get_file_url(file_uuid, download=True, extension=ext)
-        video_url = f"https://youtube.com/watch?v={video_id}"
-
-        info_text = build_info_text(
-            title=metadata.get('title', 'Unknown'),
-            uploader=metadata.get('uploader', 'Unknown'),
-            views=metadata.get('view_count', 0),
-            duration=metadata.get('duration', 0),
-            likes=metadata.get('like_count', 0),
-            dislikes=fetch_dislikes(video_id),
-            size_bytes=file_info.get('size_bytes', 0) if file_info else 0,
-            icon="🎵" if is_audio else "📺",
-            extra=" • 🎧 320kbps MP3" if is_audio else ""
-        )
+    async def expand():
+        try:
+            for url in urls:
+                remaining = PLAYLIST_MAX_ENTRIES - batch.total
+                if remaining <= 0:
+                    break
+                try:
+                    async with aclosing(bot.downloader.expand_playlist(url, remaining)) as expanded:
+                        async for entry in expanded:
+                            await entries.put((batch.add(entry), entry['url']))
+                            publisher.publish(render())
+                            if batch.total >= PLAYLIST_MAX_ENTRIES:
+                                break
+                except DownloadError as e:
+                    batch.fail(batch.add({'url': url}), str(e))
+        finally:
+            batch.expanding = False
+            publisher.publish(render())
+            for _ in range(PLAYLIST_WORKERS):
+                await entries.put(None)
+
+    async def work():
+        while (item := await entries.get()) is not None:
+            index, url = item
+
+            def on_progress(event):
+                batch.update(index, event)
+                publisher.publish(render())
 
-        if is_audio:
-            class LayoutView(ui.LayoutView):
-                container = ui.Container(
-                    ui.TextDisplay(info_text),
-                    ui.ActionRow(
-                        ui.Button(label="YouTube", url=video_url, style=discord.ButtonStyle.link),
-                        ui.Button(label="Stream", url=file_url, style=discord.ButtonStyle.link),
-                        ui.Button(label="Download", url=download_url, style=discord.ButtonStyle.link)
-                    ),
-                    accent_colour=discord.Colour.green()
-                )
-        else:
-            class LayoutView(ui.LayoutView):
-                container = ui.Container(
-                    ui.TextDisplay(info_text),
-                    ui.MediaGallery(discord.MediaGalleryItem(media=file_url)),
-                    ui.ActionRow(
-                        ui.Button(label="YouTube", url=video_url, style=discord.ButtonStyle.link),
-                        ui.Button(label="Stream", url=file_url, style=discord.ButtonStyle.link),
-                        ui.Button(label="Download", url=download_url, style=discord.ButtonStyle.link)
-                    ),
-                    accent_colour=discord.Colour.red()
-                )
-
-        if hidden:
-            await interaction.followup.send(view=LayoutView(), ephemeral=True)
-        else:
-            can_send = False
             try:
-                if hasattr(interaction.channel, 'permissions_for') and interaction.guild:
-                    bot_perms = interaction.channel.permissions_for(interaction.guild.me)
-                    can_send = bot_perms.send_messages
-                elif isinstance(interaction.channel, discord.DMChannel):
-                    can_send = True
-            except:
-                pass
-            
-            if can_send:
-                try:
-                    await interaction.channel.send(view=LayoutView())
-                except:
-                    await interaction.followup.send(view=LayoutView(), ephemeral=False)
-            else:
-                await interaction.followup.send(view=LayoutView(), ephemeral=False)
+                metadata, file_uuid, cached = await fetch_entry(url, is_audio, interaction.user.id,
+                                                                interaction.guild_id, on_progress, audio_mode)
+                batch.finish(index, metadata, file_uuid, cached)
+            except Exception as e:
+                batch.fail(index, str(e))
+            publisher.publish(render())
 
-        media_type = "audio" if is_audio else "video"
-        print(f" Downloaded {media_type}: {metadata.get('title', 'Unknown')} -> {file_uuid}")
+    try:
+        await asyncio.gather(expand(), *(work() for _ in range(PLAYLIST_WORKERS)))
+    finally:
+        await publisher.close(render())
+
+    print(f" Batch {'audio' if is_audio else 'video'}: {batch.completed}/{batch.total} ready "
+          f"({batch.cached} cached, {batch.failed} failed)")
+    if not batch.completed:
+        await interaction.followup.send(embed=create_error_embed("Nothing could be downloaded"), ephemeral=True)
+        return
+    await send_batch_card(interaction, batch, is_audio, make_zip, hidden)
+
+
+async def send_batch_card(interaction: discord.Interaction, batch: BatchProgress, is_audio: bool,
+                          make_zip: bool, hidden: bool):
+    ready = [entry for entry in batch.entries if entry.get('file_uuid')]
+    file_infos = {entry['file_uuid']: bot.file_manager.get_file_info(entry['file_uuid']) or {} for entry in ready}
+    total_size = sum(info.get('size_bytes', 0) for info in file_infos.values())
+
+    lines = []
+    for number, entry in enumerate(batch.entries, start=1):
+        title = re.sub(r'[\[\]]', '', entry['title'] or 'Unknown')[:80]
+        if entry.get('file_uuid'):
+            ext = media_extension(is_audio, file_info=file_infos[entry['file_uuid']])
+            lines.append(f"{number}. [{title}]({bot.file_server.get_file_url(entry['file_uuid'], extension=ext)})")
+        else:
+            lines.append(f"{number}. ~~{title}~~ ({entry.get('error', 'failed')[:80]})")
+
+    text = f"**{batch.title or 'Batch download'}**\n"
+    text += f"{'🎵' if is_audio else '📺'} {len(ready)} of {batch.total} ready • 📁 {format_size(total_size)} • ⏳ Expires in {FILE_EXPIRY_HOURS}h\n\n"
+    for number, line in enumerate(lines):
+        if len(text) + len(line) > 3800:
+            text += f"…and {len(lines) - number} more"
+            break
+        text += line + "\n"
+
+    buttons = []
+    if make_zip and bot.file_server.live_registry:
+        files = [(entry['file_uuid'], f"{number:02d} - {UNSAFE_FILENAME_RE.sub('_', entry['title'] or 'Unknown')[:100]}"
+                                      f"{media_extension(is_audio, file_info=file_infos[entry['file_uuid']])}")
+                 for number, entry in enumerate(batch.entries, start=1) if entry.get('file_uuid')]
+        bundle_id = bot.file_server.register_bundle(re.sub(r'[^\w\- ]', '_', batch.title or 'playlist')[:60], files)
+        buttons.append(ui.Button(label="Download zip", url=bot.file_server.get_bundle_url(bundle_id), style=discord.ButtonStyle.link))
+
+    class LayoutView(ui.LayoutView):
+        container = ui.Container(
+            ui.TextDisplay(text),
+            *([ui.ActionRow(*buttons)] if buttons else []),
+            accent_colour=discord.Colour.green() if is_audio else discord.Colour.red()
+        )
 
-    except Exception as e:
+    await deliver_view(interaction, LayoutView(), hidden)
+
+
+async def send_result_card(interaction: discord.Interaction, metadata: dict, video_id: str,
+                           file_uuid: str, is_audio: bool, hidden: bool):
+    file_info = bot.file_manager.get_file_info(file_uuid)
+    ext = media_extension(is_audio, file_info=file_info)
+    file_url = bot.file_server.get_file_url(file_uuid, download=False, extension=ext)
+    download_url = bot.file_server.get_file_url(file_uuid, download=True, extension=ext)
+    video_url = f"https://youtube.com/watch?v={video_id}"
+    with bot.metrics.timer("stage_seconds", stage="dislike_lookup"):
+        dislikes = await bot.dislikes.get(video_id)
+
+    info_text = build_info_text(
+        title=metadata.get('title') or 'Unknown',
+        uploader=metadata.get('uploader') or 'Unknown',
+        views=metadata.get('view_count') or 0,
+        duration=metadata.get('duration') or 0,
+        likes=metadata.get('like_count') or 0,
+        dislikes=dislikes,
+        size_bytes=file_info.get('size_bytes', 0) if file_info else 0,
+        icon="🎵" if is_audio else "📺",
+        extra=((" • 🎧 320kbps MP3" if ext == ".mp3" else f" • 🎧 Original {ext.lstrip('.').upper()}") if is_audio else (
+            f" • 📉 {metadata['height']}p" if (metadata.get('height') or VIDEO_HEIGHTS[0]) < VIDEO_HEIGHTS[0] else ""
+        )) + clip_label(metadata)
+    )
+
+    if is_audio:
+        class LayoutView(ui.LayoutView):
+            container = ui.Container(
+                ui.TextDisplay(info_text),
+                ui.ActionRow(
+                    ui.Button(label="YouTube", url=video_url, style=discord.ButtonStyle.link),
+                    ui.Button(label="Stream", url=file_url, style=discord.ButtonStyle.link),
+                    ui.Button(label="Download", url=download_url, style=discord.ButtonStyle.link)
+                ),
+                accent_colour=discord.Colour.green()
+            )
+    else:
+        class LayoutView(ui.LayoutView):
+            container = ui.Container(
+                ui.TextDisplay(info_text),
+                ui.MediaGallery(discord.MediaGalleryItem(media=file_url)),
+                ui.ActionRow(
+                    ui.Button(label="YouTube", url=video_url, style=discord.ButtonStyle.link),
+                    ui.Button(label="Stream", url=file_url, style=discord.ButtonStyle.link),
+                    ui.Button(label="Download", url=download_url, style=discord.ButtonStyle.link)
+                ),
+                accent_colour=discord.Colour.red()
+            )
+
+    with bot.metrics.timer("stage_seconds", stage="card_send"):
+        await deliver_view(interaction, LayoutView(), hidden)
+
+
+async def deliver_view(interaction: discord.Interaction, view: ui.LayoutView, hidden: bool):
+    if hidden:
+        await interaction.followup.send(view=view, ephemeral=True)
+    else:
+        can_send = False
         try:
-            await interaction.edit_original_response(embed=create_error_embed(str(e), url))
+            if hasattr(interaction.channel, 'permissions_for') and interaction.guild:
+                bot_perms = interaction.channel.permissions_for(interaction.guild.me)
+                can_send = bot_perms.send_messages
+            elif isinstance(interaction.channel, discord.DMChannel):
+                can_send = True
         except:
-            await interaction.followup.send(embed=create_error_embed(str(e), url))
+            pass
+        
+        if can_send:
+            try:
+                await interaction.channel.send(view=view)
+            except:
+                await interaction.followup.send(view=view, ephemeral=False)
+        else:
+            await interaction.followup.send(view=view, ephemeral=False)
 
 
 @bot.tree.command(name="video", description="Download a YouTube video in 1080p quality")
-@app_commands.describe(url="The YouTube video URL to download", hidden="Only you can see the result")
+@app_commands.describe(
+    url="The YouTube video URL to download",
+    start="Clip start time (seconds, MM:SS or HH:MM:SS)",
+    end="Clip end time (seconds, MM:SS or HH:MM:SS)",
+    accurate="Cut exactly at the given times (slower, re-encodes around the cuts)",
+    hidden="Only you can see the result"
+)
 @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
 @app_commands.allowed_installs(guilds=True, users=True)
-async def download_video(interaction: discord.Interaction, url: str, hidden: bool = False):
-    await process_download(interaction, url, is_audio=False, hidden=hidden)
-
-
-@bot.tree.command(name="audio", description="Download a YouTube video as 320kbps MP3")
-@app_commands.describe(url="The YouTube video URL to extract audio from", hidden="Only you can see the result")
+async def download_video(interaction: discord.Interaction, url: str, start: str = None, end: str = None,
+                         accurate: bool = False, hidden: bool = False):
+    await process_download(interaction, url, is_audio=False, hidden=hidden, start=start, end=end, accurate=accurate)
+
+
+AUDIO_FORMAT_CHOICES = [
+    app_commands.Choice(name="MP3 320kbps (re-encoded)", value=AUDIO_MODE_MP3),
+    app_commands.Choice(name="Original M4A/Opus (fast, no re-encode)", value=AUDIO_MODE_COPY),
+]
+
+
+@bot.tree.command(name="audio", description="Download the audio of a YouTube video")
+@app_commands.describe(
+    url="The YouTube video URL to extract audio from",
+    format="MP3 320kbps, or the original track without re-encoding",
+    start="Clip start time (seconds, MM:SS or HH:MM:SS)",
+    end="Clip end time (seconds, MM:SS or HH:MM:SS)",
+    accurate="Cut exactly at the given times (slower, re-encodes around the cuts)",
+    hidden="Only you can see the result"
+)
+@app_commands.choices(format=AUDIO_FORMAT_CHOICES)
+@app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
+@app_commands.allowed_installs(guilds=True, users=True)
+async def download_audio(interaction: discord.Interaction, url: str, format: app_commands.Choice[str] = None,
+                         start: str = None, end: str = None, accurate: bool = False, hidden: bool = False):
+    await process_download(interaction, url, is_audio=True, hidden=hidden,
+                           audio_mode=format.value if format else AUDIO_MODE,
+                           start=start, end=end, accurate=accurate)
+
+
+@bot.tree.command(name="playlist", description="Download a playlist, or several YouTube URLs at once")
+@app_commands.describe(
+    urls="A playlist URL, or several video/playlist URLs separated by spaces",
+    audio="Extract audio instead of video",
+    audio_format="MP3 320kbps, or the original track without re-encoding",
+    zip="Also offer everything as a single zip download",
+    hidden="Only you can see the result"
+)
+@app_commands.choices(audio_format=AUDIO_FORMAT_CHOICES)
 @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
 @app_commands.allowed_installs(guilds=True, users=True)
-async def download_audio(interaction: discord.Interaction, url: str, hidden: bool = False):
-    await process_download(interaction, url, is_audio=True, hidden=hidden)
+async def download_playlist(interaction: discord.Interaction, urls: str, audio: bool = False,
+                            audio_format: app_commands.Choice[str] = None, zip: bool = False, hidden: bool = False):
+    await process_batch(interaction, urls.split(), is_audio=audio, make_zip=zip, hidden=hidden,
+                        audio_mode=audio_format.value if audio_format else AUDIO_MODE)
 
 
 @bot.tree.command(name="stats", description="Show bot statistics and file storage info")
@@ -257,8 +783,33 @@ async def show_stats(interaction: discord.Interaction):
     embed = discord.Embed(title=" Bot Statistics", color=0x5865F2, timestamp=discord.utils.utcnow())
     embed.add_field(name=" Files Stored", value=str(stats['total_files']), inline=True)
     embed.add_field(name=" Total Size", value=f"{stats['total_size_mb']} MB", inline=True)
+    budget = format_size(stats['max_bytes']) if stats['max_bytes'] else "unlimited"
+    file_budget = stats['max_files'] or "unlimited"
+    embed.add_field(name=" Storage", value=f"{format_size(stats['used_bytes'])} / {budget}\n{stats['total_files']} / {file_budget} files\n{stats['evictions']} evicted", inline=True)
     embed.add_field(name="⏰ File Expiry", value=f"{stats['expiry_hours']} hours", inline=True)
-    embed.add_field(name=" File Server", value=FILE_SERVER_DOMAIN, inline=True)
+    embed.add_field(name=" Cache", value=f"{stats['cache_hits']} hits / {stats['cache_misses']} misses", inline=True)
+    placements = stats['placements']
+    embed.add_field(name=" Placement", value=f"{placements['rename']} renamed / {placements['reflink']} reflinked / {placements['copy']} copied", inline=True)
+    embed.add_field(name=" Downloads", value=f"{bot.scheduler.active} active / {bot.scheduler.queue_depth} queued", inline=True)
+    derived = bot.metrics.get("audio_jobs_total", source="upload") + bot.metrics.get("audio_jobs_total", source="download")
+    saved = bot.metrics.get("audio_derive_seconds_saved_total")
+    encode_lines = []
+    for mode in (AUDIO_MODE_MP3, AUDIO_MODE_COPY):
+        encodes = bot.metrics.get("audio_encodes_total", audio_mode=mode)
+        if encodes:
+            average = bot.metrics.get("audio_encode_seconds_total", audio_mode=mode) / encodes
+            encode_lines.append(f"{mode}: {average:.1f}s avg ({int(encodes)} jobs)")
+    embed.add_field(name=" Audio Encode", value="\n".join(encode_lines) or "No encodes yet", inline=True)
+    embed.add_field(name=" Local Audio", value=f"{int(derived)} derived / {int(bot.metrics.get('audio_jobs_total', source='network'))} fetched\n~{format_duration(saved)} saved", inline=True)
+    embed.add_field(name=" File Server", value=bot.file_server.domain, inline=True)
+    bandwidth = bot.file_server.bandwidth_stats()
+    by_kind = bandwidth['by_kind']
+    embed.add_field(name=" Egress", value=(
+        f"{format_rate(bandwidth['bytes_per_second'])} "
+        f"({format_rate(by_kind.get('files'))} stream / {format_rate(by_kind.get('download', 0) + by_kind.get('zip', 0))} bulk)\n"
+        f"{bandwidth['connections']} connections / {bandwidth['rejected']} rejected\n"
+        f"{format_size(bandwidth['bytes_served']) if bandwidth['bytes_served'] else '0 B'} served"
+    ), inline=True)
     embed.add_field(name=" Servers", value=str(len(bot.guilds)), inline=True)
     embed.set_footer(text="YouTube Downloader Bot")
 
@@ -0,0 +1,81 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import aiohttp
+
+
+class DislikeClient:
+    def __init__(self, base_url: str = "https://returnyoutubedislikeapi.com", ttl: int = 3600,
+                 negative_ttl: int = 300, max_entries: int = 4096, timeout: float = 5):
+        self.base_url = base_url.rstrip('/')
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._cache: "OrderedDict[str, Tuple[float, Optional[int]]]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=16, ttl_dns_cache=300),
+                timeout=self.timeout
+            )
+        return self._session
+
+    def _cached(self, video_id: str) -> Tuple[bool, Optional[int]]:
+        hit = self._cache.get(video_id)
+        if hit is None:
+            return False, None
+        expires, value = hit
+        if time.monotonic() > expires:
+            del self._cache[video_id]
+            return False, None
+        self._cache.move_to_end(video_id)
+        return True, value
+
+    def _store(self, video_id: str, value: Optional[int]):
+        ttl = self.ttl if value is not None else self.negative_ttl
+        self._cache[video_id] = (time.monotonic() + ttl, value)
+        self._cache.move_to_end(video_id)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def _fetch(self, video_id: str) -> Optional[int]:
+        try:
+            async with self._get_session().get(f"{self.base_url}/Votes", params={"videoId": video_id}) as resp:
+                if resp.status == 200:
+                    return (await resp.json()).get("dislikes", 0)
+        except Exception:
+            pass
+        return None
+
+    async def _lookup(self, video_id: str) -> Optional[int]:
+        try:
+            value = await self._fetch(video_id)
+            self._store(video_id, value)
+            return value
+        finally:
+            self._pending.pop(video_id, None)
+
+    def prefetch(self, video_id: str) -> asyncio.Future:
+        found, value = self._cached(video_id)
+        if found:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(value)
+            return future
+        task = self._pending.get(video_id)
+        if task is None:
+            task = asyncio.create_task(self._lookup(video_id))
+            self._pending[video_id] = task
+        return task
+
+    async def get(self, video_id: str) -> int:
+        return await asyncio.shield(self.prefetch(video_id)) or 0
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
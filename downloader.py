@@ -1,27 +1,213 @@
+import asyncio
+import os
+import signal
 import subprocess
 import json
+import math
 import re
 import shutil
+import tempfile
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, Dict, Any, Tuple
+from typing import AsyncIterator, NamedTuple, Optional, Dict, Any, Set, Tuple
 
-VIDEO_FORMAT = (
-    "bestvideo[height<=1080][vcodec^=avc1]+bestaudio[acodec^=mp4a]/"
-    "bestvideo[height<=1080][vcodec^=avc1]+bestaudio/"
-    "bestvideo[height<=1080]+bestaudio/best"
+from progress import PHASE_POSTPROCESS, ProgressEvent, ProgressThrottle
+from ytdlp_engine import InProcessEngine
+
+VIDEO_HEIGHTS = (1080, 720, 480, 360)
+
+
+def video_format(max_height: int = 1080) -> str:
+    return (
+        f"bestvideo[height<={max_height}][vcodec^=avc1]+bestaudio[acodec^=mp4a]/"
+        f"bestvideo[height<={max_height}][vcodec^=avc1]+bestaudio/"
+        f"bestvideo[height<={max_height}]+bestaudio/best"
+    )
+
+
+VIDEO_FORMAT = video_format(1080)
+AUDIO_FORMAT = "bestaudio/best"
+AUDIO_CODEC = "mp3"
+AUDIO_QUALITY = "320K"
+AUDIO_MODE_MP3 = "mp3"
+AUDIO_MODE_COPY = "copy"
+COPY_AUDIO_FORMAT = "bestaudio[acodec^=mp4a]/bestaudio/best"
+
+PROGRESS_PREFIX = "[PROGRESS] "
+POSTPROCESS_PREFIX = "[POSTPROCESS] "
+
+_FORMAT_PART_RE = re.compile(r'\.f\d+(?:-\d+)?\.\w+$')
+_TIME_PART_RE = re.compile(r'\d+(?:\.\d+)?', re.ASCII)
+PROGRESSIVE_EXTENSIONS = ('.mp4', '.m4a', '.webm', '.mp3')
+
+_VIDEO_ID_RE = re.compile(
+    r'(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/|v/)|youtu\.be/)([A-Za-z0-9_-]{11})'
 )
 
 
+class DownloadError(Exception):
+    pass
+
+
+class Clip(NamedTuple):
+    start: float = 0
+    end: Optional[float] = None
+    accurate: bool = False
+
+    @property
+    def tag(self) -> str:
+        end = f"{self.end:g}" if self.end is not None else "end"
+        return f"clip-{self.start:g}-{end}{'k' if self.accurate else ''}"
+
+    @property
+    def section(self) -> str:
+        return f"*{self.start:g}-{f'{self.end:g}' if self.end is not None else 'inf'}"
+
+    def length(self, duration: float) -> float:
+        end = self.end if self.end is not None else duration
+        if duration:
+            end = min(end, duration)
+        return max((end or 0) - self.start, 0)
+
+
+def parse_timestamp(value: str) -> float:
+    parts = value.strip().split(':')
+    if len(parts) > 3 or not all(_TIME_PART_RE.fullmatch(part) for part in parts):
+        raise DownloadError(f"Invalid time '{value}', use seconds, MM:SS or HH:MM:SS")
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + float(part)
+    if not math.isfinite(seconds):
+        raise DownloadError(f"Invalid time '{value}'")
+    return seconds
+
+
+def make_clip(start: Optional[str], end: Optional[str], accurate: bool = False) -> Optional[Clip]:
+    if not start and not end:
+        return None
+    clip = Clip(parse_timestamp(start) if start else 0, parse_timestamp(end) if end else None, accurate)
+    if clip.end is not None and clip.end <= clip.start:
+        raise DownloadError("The end time must be after the start time")
+    return clip
+
+
+class _OutputParser:
+    def __init__(self):
+        self.metadata: Optional[Dict[str, Any]] = None
+        self.last_error = ""
+        self.filenames: Set[str] = set()
+
+    def feed(self, line: str) -> Optional[ProgressEvent]:
+        try:
+            if line.startswith(PROGRESS_PREFIX):
+                event = ProgressEvent.from_download(json.loads(line[len(PROGRESS_PREFIX):]))
+                if event.filename:
+                    self.filenames.add(event.filename)
+                return event
+            if line.startswith(POSTPROCESS_PREFIX):
+                return ProgressEvent.from_postprocess(json.loads(line[len(POSTPROCESS_PREFIX):]))
+            if line.startswith('{'):
+                self.metadata = json.loads(line)
+                return None
+        except json.JSONDecodeError:
+            pass
+
+        if line.strip():
+            print(f"[yt-dlp] {line.rstrip()}")
+            if line.startswith('ERROR:'):
+                self.last_error = line[len('ERROR:'):].strip()
+        return None
+
+
 def _has_aria2c() -> bool:
     return shutil.which("aria2c") is not None
 
 
+def extract_video_id(url: str) -> Optional[str]:
+    match = _VIDEO_ID_RE.search(url)
+    return match.group(1) if match else None
+
+
+def is_progressive(filename: str, is_audio: bool = False, audio_mode: str = AUDIO_MODE_MP3) -> bool:
+    if not filename or _FORMAT_PART_RE.search(filename):
+        return False
+    suffix = Path(filename).suffix.lower()
+    if is_audio:
+        # ExtractAudio replaces every source except an m4a kept in copy mode with a new file
+        return audio_mode == AUDIO_MODE_COPY and suffix == '.m4a'
+    return suffix in PROGRESSIVE_EXTENSIONS
+
+
+def format_key(is_audio: bool = False, max_height: int = 1080, audio_mode: str = AUDIO_MODE_MP3,
+               clip: Optional[Clip] = None) -> str:
+    if is_audio and audio_mode == AUDIO_MODE_COPY:
+        key = f"{COPY_AUDIO_FORMAT}|copy"
+    elif is_audio:
+        key = f"{AUDIO_FORMAT}|{AUDIO_CODEC}-{AUDIO_QUALITY}"
+    else:
+        key = video_format(max_height)
+    return f"{key}|{clip.tag}" if clip else key
+
+
+def _format_size(fmt: Dict[str, Any], duration: float) -> float:
+    return fmt.get('filesize') or fmt.get('filesize_approx') or (fmt.get('tbr') or 0) * 125 * duration
+
+
+def estimate_size(info: Dict[str, Any], is_audio: bool = False, max_height: int = 1080,
+                  audio_mode: str = AUDIO_MODE_MP3) -> int:
+    duration = info.get('duration') or 0
+    if is_audio and audio_mode != AUDIO_MODE_COPY:
+        return int(int(AUDIO_QUALITY.rstrip('K')) * 125 * duration)
+
+    formats = info.get('formats') or []
+    audio = [f for f in formats if f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none')]
+    if is_audio:
+        audio = [f for f in audio if (f.get('acodec') or '').startswith('mp4a')] or audio
+        best_audio = max(audio, key=lambda f: f.get('abr') or f.get('tbr') or 0, default=info)
+        return int(_format_size(best_audio, duration))
+    video = [f for f in formats if f.get('vcodec') not in (None, 'none') and f.get('acodec') == 'none'
+             and (f.get('height') or 0) <= max_height]
+    video = [f for f in video if (f.get('vcodec') or '').startswith('avc1')] or video
+    muxed = [f for f in formats if f.get('vcodec') not in (None, 'none') and f.get('acodec') not in (None, 'none')]
+
+    best_video = max(video, key=lambda f: (f.get('height') or 0, f.get('tbr') or 0), default=None)
+    best_audio = max(audio, key=lambda f: f.get('abr') or f.get('tbr') or 0, default=None)
+    if best_video is None or best_audio is None:
+        best = max(muxed, key=lambda f: (f.get('height') or 0, f.get('tbr') or 0), default=info)
+        return int(_format_size(best, duration))
+    return int(_format_size(best_video, duration) + _format_size(best_audio, duration))
+
+
+def pick_video_height(info: Dict[str, Any], max_bytes: int) -> Optional[int]:
+    for height in VIDEO_HEIGHTS:
+        if not max_bytes or estimate_size(info, max_height=height) <= max_bytes:
+            return height
+    return None
+
+
 class YouTubeDownloader:
-    def __init__(self, download_dir: str = "./downloads"):
+    def __init__(self, download_dir: str = "./downloads", engine: str = "subprocess",
+                 progress_step: float = 5, progress_interval: float = 1.0,
+                 probe_ttl: int = 1800, max_probes: int = 1024, max_concurrent_probes: int = 4):
         self.download_dir = Path(download_dir)
+        self.progress_step = progress_step
+        self.progress_interval = progress_interval
+        self.probe_ttl = probe_ttl
+        self.max_probes = max_probes
+        self._probes: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._pending_probes: Dict[str, asyncio.Task] = {}
+        self._probe_slots = asyncio.Semaphore(max_concurrent_probes)
+        self.probe_executor = ThreadPoolExecutor(max_workers=max_concurrent_probes, thread_name_prefix="probe")
         self.download_dir.mkdir(parents=True, exist_ok=True)
         self._use_aria2c = _has_aria2c()
+        self.engine = engine
+        self._inprocess: Optional[InProcessEngine] = InProcessEngine() if engine == "inprocess" else None
+
+    def shutdown(self):
+        self.probe_executor.shutdown(wait=False, cancel_futures=True)
 
     def _clean_url(self, url: str) -> str:
         url = re.sub(r'[&?]t=\d+s?', '', url)
@@ -30,6 +216,9 @@ class YouTubeDownloader:
         url = re.sub(r'[&?]start_radio=\d+', '', url)
         return url.rstrip('&?')
 
+    def job_key(self, url: str, mode: str, fmt: str = "") -> Tuple[str, str, str]:
+        return self._clean_url(url), mode, fmt
+
     def _run_ytdlp(self, url: str, args: list) -> Tuple[bool, str, Optional[Dict[str, Any]]]:
         cmd = [
             "yt-dlp",
@@ -81,149 +270,395 @@ class YouTubeDownloader:
             args.extend(["--downloader", "aria2c", "--downloader-args", "aria2c:-x 16 -s 16 -k 1M"])
         return self._run_ytdlp(url, args)
 
-    def download_with_progress(self, url: str, is_audio: bool = False):
-        if is_audio:
-            args = [
-                "-f", "bestaudio/best",
+    def _mode_args(self, is_audio: bool, max_height: int = 1080, audio_mode: str = AUDIO_MODE_MP3) -> list:
+        if is_audio and audio_mode == AUDIO_MODE_COPY:
+            return [
+                "-f", COPY_AUDIO_FORMAT,
                 "-x",
-                "--audio-format", "mp3",
-                "--audio-quality", "320K",
+                "--audio-format", "best",
                 "--embed-thumbnail",
                 "--add-metadata",
             ]
-        else:
-            args = [
-                "-f", VIDEO_FORMAT,
-                "--merge-output-format", "mp4",
+        if is_audio:
+            return [
+                "-f", AUDIO_FORMAT,
+                "-x",
+                "--audio-format", AUDIO_CODEC,
+                "--audio-quality", AUDIO_QUALITY,
+                "--embed-thumbnail",
                 "--add-metadata",
-                "--ppa", "ffmpeg:-c copy -fflags +genpts -movflags +faststart",
             ]
+        return [
+            "-f", video_format(max_height),
+            "--merge-output-format", "mp4",
+            "--add-metadata",
+            "--ppa", "ffmpeg:-c copy -fflags +genpts -movflags +faststart",
+        ]
 
-        cmd = [
-            "yt-dlp",
+    def _common_args(self) -> list:
+        return [
             "--cookies-from-browser", "firefox",
             "--remote-components", "ejs:github",
             "--no-warnings",
-            "--print-json",
             "--no-part",
             "--windows-filenames",
             "--no-playlist",
-            "--newline",
-            "--progress",
             "--no-check-certificates",
             "--sleep-requests", "0",
             "--extractor-args", "youtube:player_client=mweb,tv",
-            "--progress-template", "download:[PROGRESS] %(progress._percent_str)s %(progress._speed_str)s ETA %(progress._eta_str)s",
             "-N", "1000",
-            "-o", str(self.download_dir / "%(id)s.%(ext)s"),
-            *args,
-            self._clean_url(url)
         ]
 
+    def _engine_args(self, is_audio: bool, max_height: int = 1080, audio_mode: str = AUDIO_MODE_MP3,
+                     clip: Optional[Clip] = None) -> list:
+        args = [
+            *self._common_args(),
+            "-o", str(self.download_dir / (f"%(id)s.{clip.tag}.%(ext)s" if clip else "%(id)s.%(ext)s")),
+            *self._mode_args(is_audio, max_height, audio_mode),
+        ]
+        if clip:
+            args.extend(["--download-sections", clip.section])
+            if clip.accurate:
+                args.append("--force-keyframes-at-cuts")
+        return args
+
+    def warm(self):
+        if not self._inprocess:
+            return
+        try:
+            self._inprocess.warm(self._engine_args(False))
+            self._inprocess.warm(self._engine_args(True))
+            print(" In-process yt-dlp engine warmed up")
+        except Exception as e:
+            print(f" yt-dlp warm-up failed: {e}")
+
+    def cached_probe(self, video_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        hit = self._probes.get(video_id) if video_id else None
+        if hit is None:
+            return None
+        expires, info = hit
+        if time.monotonic() > expires:
+            del self._probes[video_id]
+            return None
+        self._probes.move_to_end(video_id)
+        return info
+
+    def _store_probe(self, info: Dict[str, Any]):
+        self._probes[info['id']] = (time.monotonic() + self.probe_ttl, info)
+        self._probes.move_to_end(info['id'])
+        while len(self._probes) > self.max_probes:
+            self._probes.popitem(last=False)
+
+    async def _run_probe(self, url: str, executor: Optional[Executor]) -> Dict[str, Any]:
+        if self._inprocess:
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(executor or self.probe_executor, self._inprocess.probe, url,
+                                                  self._common_args())
+            except Exception as e:
+                raise DownloadError(str(e))
+
         try:
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1
+            process = await asyncio.create_subprocess_exec(
+                "yt-dlp", *self._common_args(), "--dump-single-json", url,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
             )
+        except FileNotFoundError:
+            raise DownloadError("yt-dlp not found")
 
-            metadata = None
-            last_percent = -1
-            last_update = 0
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            errors = [line for line in stderr.decode(errors='replace').splitlines() if line.startswith('ERROR:')]
+            raise DownloadError(errors[-1][len('ERROR:'):].strip() if errors else "Could not fetch video info")
+        try:
+            return json.loads(stdout)
+        except json.JSONDecodeError:
+            raise DownloadError("Could not parse yt-dlp output")
 
-            for line in process.stdout:
-                line = line.strip()
-                if not line:
-                    continue
-                
-                if 'Unknown' in line or 'N/A' in line:
-                    continue
+    async def _probe_once(self, url: str, executor: Optional[Executor]) -> Dict[str, Any]:
+        try:
+            async with self._probe_slots:
+                info = await self._run_probe(url, executor)
+            self._store_probe(info)
+            return info
+        finally:
+            self._pending_probes.pop(url, None)
+
+    async def probe(self, url: str, executor: Optional[Executor] = None) -> Dict[str, Any]:
+        cached = self.cached_probe(extract_video_id(url))
+        if cached:
+            return cached
+
+        url = self._clean_url(url)
+        task = self._pending_probes.get(url)
+        if task is None:
+            task = asyncio.create_task(self._probe_once(url, executor))
+            self._pending_probes[url] = task
+        return await asyncio.shield(task)
+
+    async def expand_playlist(self, url: str, limit: int = 0) -> AsyncIterator[Dict[str, Any]]:
+        video_id = extract_video_id(url)
+        if video_id and 'list=' not in url:
+            yield {'id': video_id, 'url': self._clean_url(url)}
+            return
+
+        cmd = ["yt-dlp", *self._common_args(), "--yes-playlist", "--flat-playlist", "--dump-json"]
+        if limit:
+            cmd.extend(["--playlist-items", f"1:{limit}"])
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd, url,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                start_new_session=True,
+                limit=16 * 1024 * 1024
+            )
+        except FileNotFoundError:
+            raise DownloadError("yt-dlp not found")
 
-                if '[download]' in line and '[PROGRESS]' not in line and '%' not in line:
+        parser = _OutputParser()
+        found = 0
+        try:
+            async for raw in process.stdout:
+                parser.feed(raw.decode(errors='replace'))
+                entry, parser.metadata = parser.metadata, None
+                if not entry or not entry.get('id'):
                     continue
-                
-                print(f"[yt-dlp] {line}")
-
-                if line.startswith('{'):
-                    try:
-                        metadata = json.loads(line)
-                    except json.JSONDecodeError:
-                        pass
-                elif '[PROGRESS]' in line:
-                    match = re.search(r'\[PROGRESS\]\s+(\d+\.?\d*)%\s+(\S+)\s+ETA\s+(\S+)', line)
-                    if match:
-                        try:
-                            percent = float(match.group(1))
-                            speed = match.group(2)
-                            eta = match.group(3)
-                            
-                            if 'Unknown' in speed or 'Unknown' in eta or 'N/A' in speed or 'N/A' in eta:
-                                continue
-                            
-                            now = time.time()
-                            if (int(percent) >= last_percent + 5 or int(percent) >= 99) and (now - last_update >= 1.0 or int(percent) >= 99):
-                                last_percent = int(percent)
-                                last_update = now
-                                yield ('progress', percent, speed, eta)
-                        except (ValueError, IndexError):
-                            pass
-                elif '[download]' in line and '%' in line:
-                    match = re.search(r'(\d+\.?\d*)%', line)
-                    if match:
-                        try:
-                            percent = float(match.group(1))
-                            speed_match = re.search(r'at\s+(\S+)', line)
-                            eta_match = re.search(r'ETA\s+(\S+)', line)
-                            speed = speed_match.group(1) if speed_match else "..."
-                            eta = eta_match.group(1) if eta_match else "..."
-                            
-                            if 'Unknown' in speed or 'Unknown' in eta:
-                                continue
-                            
-                            now = time.time()
-                            if (int(percent) >= last_percent + 5 or int(percent) >= 99) and (now - last_update >= 1.0 or int(percent) >= 99):
-                                last_percent = int(percent)
-                                last_update = now
-                                yield ('progress', percent, speed, eta)
-                        except (ValueError, IndexError):
-                            pass
-
-            process.wait()
-
-            if process.returncode != 0:
-                yield ('error', "Download failed", None)
-                return
+                found += 1
+                if entry.get('formats'):
+                    self._store_probe(entry)
+                entry['url'] = entry.get('webpage_url') or f"https://www.youtube.com/watch?v={entry['id']}"
+                yield entry
+            await process.wait()
+        finally:
+            if process.returncode is None:
+                self._kill(process)
+                await process.wait()
+
+        if process.returncode != 0 and not found:
+            raise DownloadError(parser.last_error or "Could not expand playlist")
+
+    def _write_info(self, info: Optional[Dict[str, Any]]) -> Optional[Path]:
+        if not info:
+            return None
+        fd, path = tempfile.mkstemp(prefix=f"{info.get('id', 'probe')}.", suffix=".info.json", dir=self.download_dir)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(info, f)
+        return Path(path)
+
+    def _throttle(self) -> ProgressThrottle:
+        return ProgressThrottle(self.progress_step, self.progress_interval)
+
+    def _progress_cmd(self, url: str, is_audio: bool, max_height: int = 1080, info_path: Optional[Path] = None,
+                      audio_mode: str = AUDIO_MODE_MP3, clip: Optional[Clip] = None) -> list:
+        return [
+            "yt-dlp",
+            *self._engine_args(is_audio, max_height, audio_mode, clip),
+            "--print-json",
+            "--newline",
+            "--progress",
+            "--progress-template", f"download:{PROGRESS_PREFIX}%(progress)j",
+            "--progress-template", f"postprocess:{POSTPROCESS_PREFIX}%(progress)j",
+            *(["--load-info-json", str(info_path)] if info_path else [self._clean_url(url)])
+        ]
 
-            yield ('done', metadata)
+    def _download_inprocess(self, url: str, is_audio: bool = False, max_height: int = 1080,
+                           info: Optional[Dict[str, Any]] = None, audio_mode: str = AUDIO_MODE_MP3,
+                           clip: Optional[Clip] = None, cancel: Optional[threading.Event] = None):
+        throttle = self._throttle()
+        updates = self._inprocess.download_with_progress(
+            self._clean_url(url), self._engine_args(is_audio, max_height, audio_mode, clip), info, cancel
+        )
+        for update in updates:
+            if update[0] != 'progress' or throttle.allow(update[1]):
+                yield update
+
+    async def stream(self, url: str, mode: str, executor: Optional[Executor] = None, max_height: int = 1080,
+                     info: Optional[Dict[str, Any]] = None, audio_mode: str = AUDIO_MODE_MP3,
+                     clip: Optional[Clip] = None) -> AsyncIterator[Tuple]:
+        is_audio = mode == "audio"
+
+        if self._inprocess:
+            loop = asyncio.get_running_loop()
+            updates: asyncio.Queue = asyncio.Queue()
+            cancel = threading.Event()
+            filenames: Set[str] = set()
+            started = time.time()
+
+            def pump():
+                try:
+                    for update in self._download_inprocess(url, is_audio, max_height, info, audio_mode, clip, cancel):
+                        if update[0] == 'progress' and update[1].filename:
+                            filenames.update({update[1].filename, f"{update[1].filename}.part"})
+                        loop.call_soon_threadsafe(updates.put_nowait, update)
+                finally:
+                    loop.call_soon_threadsafe(updates.put_nowait, None)
+
+            future = loop.run_in_executor(executor, pump)
+            finished = False
+            try:
+                while (update := await updates.get()) is not None:
+                    yield update
+                finished = True
+            finally:
+                if not finished:
+                    cancel.set()
+                await asyncio.shield(future)
+                if not finished:
+                    self._remove_partials(extract_video_id(url), is_audio, filenames, started)
+            return
+
+        throttle = self._throttle()
+        parser = _OutputParser()
+        started = time.time()
+        info_path = self._write_info(info)
 
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *self._progress_cmd(url, is_audio, max_height, info_path, audio_mode, clip),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                start_new_session=True,
+                limit=16 * 1024 * 1024
+            )
         except FileNotFoundError:
+            if info_path:
+                info_path.unlink(missing_ok=True)
             yield ('error', "yt-dlp not found", None)
-        except Exception as e:
-            yield ('error', str(e), None)
+            return
+
+        try:
+            async for raw in process.stdout:
+                event = parser.feed(raw.decode(errors='replace'))
+                if event and throttle.allow(event):
+                    yield ('progress', event)
+
+            await process.wait()
+        finally:
+            if info_path:
+                info_path.unlink(missing_ok=True)
+            if process.returncode is None:
+                self._kill(process)
+                await process.wait()
+                self._remove_partials(extract_video_id(url), is_audio, parser.filenames, started)
+
+        if process.returncode != 0:
+            yield ('error', parser.last_error or "Download failed", None)
+            return
+
+        yield ('done', parser.metadata)
+
+    @staticmethod
+    def _kill(process: asyncio.subprocess.Process):
+        try:
+            if hasattr(os, 'killpg'):
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except ProcessLookupError:
+            pass
+
+    def _remove_partials(self, video_id: Optional[str], is_audio: bool, filenames: Set[str], started: float):
+        candidates = {Path(name) for name in filenames}
+        if video_id:
+            ext = "mp3" if is_audio else "mp4"
+            candidates.update({self.download_dir / f"{video_id}.{ext}", self.download_dir / f"{video_id}.temp.{ext}"})
+
+        for path in candidates:
+            try:
+                if path.stat().st_mtime >= started:
+                    path.unlink()
+            except OSError:
+                pass
 
     def download_audio(self, url: str) -> Tuple[bool, str, Optional[Dict[str, Any]]]:
         args = [
-            "-f", "bestaudio/best",
+            "-f", AUDIO_FORMAT,
             "-x",
-            "--audio-format", "mp3",
-            "--audio-quality", "320K",
+            "--audio-format", AUDIO_CODEC,
+            "--audio-quality", AUDIO_QUALITY,
             "--embed-thumbnail",
             "--add-metadata",
         ]
         return self._run_ytdlp(url, args)
 
-    def get_downloaded_file_path(self, video_id: str, is_audio: bool = False) -> Optional[Path]:
-        ext = "mp3" if is_audio else "mp4"
-        expected = self.download_dir / f"{video_id}.{ext}"
+    def _derive_cmd(self, source: Path, output: Path, thumbnail: Optional[str], audio_mode: str = AUDIO_MODE_MP3,
+                    clip: Optional[Clip] = None) -> list:
+        cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin", "-y"]
+        if clip:
+            cmd.extend(["-ss", f"{clip.start:g}"])
+            if clip.end is not None:
+                cmd.extend(["-to", f"{clip.end:g}"])
+        cmd.extend(["-i", str(source)])
+        if thumbnail:
+            cmd.extend(["-i", thumbnail, "-map", "0:a:0", "-map", "1:v:0", "-c:v", "mjpeg",
+                        "-disposition:v:0", "attached_pic",
+                        "-metadata:s:v", "title=Album cover", "-metadata:s:v", "comment=Cover (front)"])
+        else:
+            cmd.extend(["-map", "0:a:0"])
+        if audio_mode == AUDIO_MODE_COPY:
+            cmd.extend(["-c:a", "copy", "-map_metadata", "0", "-movflags", "+faststart", str(output)])
+        else:
+            cmd.extend(["-c:a", "libmp3lame", "-b:a", AUDIO_QUALITY.lower(),
+                        "-map_metadata", "0", "-id3v2_version", "3", str(output)])
+        return cmd
+
+    async def derive_audio(self, source: Path, video_id: str, metadata: Optional[Dict[str, Any]] = None,
+                           audio_mode: str = AUDIO_MODE_MP3, clip: Optional[Clip] = None) -> AsyncIterator[Tuple]:
+        metadata = metadata or {}
+        ext = "m4a" if audio_mode == AUDIO_MODE_COPY else AUDIO_CODEC
+        output = self.download_dir / (f"{video_id}.{clip.tag}.{ext}" if clip else f"{video_id}.{ext}")
+        yield ('progress', ProgressEvent(PHASE_POSTPROCESS, status="started", postprocessor="ExtractAudio"))
+
+        error = "ffmpeg failed"
+        for thumbnail in dict.fromkeys([metadata.get('thumbnail'), None]):
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *self._derive_cmd(source, output, thumbnail, audio_mode, clip),
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE,
+                    start_new_session=True
+                )
+            except FileNotFoundError:
+                yield ('error', "ffmpeg not found", None)
+                return
+
+            try:
+                _, stderr = await process.communicate()
+            finally:
+                if process.returncode is None:
+                    self._kill(process)
+                    await process.wait()
+                    output.unlink(missing_ok=True)
+
+            if process.returncode == 0:
+                yield ('progress', ProgressEvent(PHASE_POSTPROCESS, status="finished", postprocessor="ExtractAudio"))
+                done = {**metadata, 'id': video_id, 'ext': ext, 'filepath': str(output)}
+                if clip:
+                    done.update(section_start=clip.start, section_end=clip.end)
+                yield ('done', done)
+                return
+            lines = stderr.decode(errors='replace').strip().splitlines()
+            error = lines[-1] if lines else error
+            output.unlink(missing_ok=True)
 
-        if expected.exists():
-            return expected
+        yield ('error', f"Could not extract audio locally: {error}", None)
 
-        for file in self.download_dir.iterdir():
-            if video_id in file.name:
-                return file
+    def get_downloaded_file_path(self, video_id: str, is_audio: bool = False,
+                                 metadata: Optional[Dict[str, Any]] = None, clip: Optional[Clip] = None) -> Optional[Path]:
+        if metadata:
+            downloads = metadata.get('requested_downloads') or [{}]
+            reported = downloads[-1].get('filepath') or metadata.get('filepath') or metadata.get('_filename')
+            if reported and Path(reported).exists():
+                return Path(reported)
+
+        ext = "mp3" if is_audio else "mp4"
+        stem = f"{video_id}.{clip.tag}" if clip else video_id
+        for candidate in (ext, "mkv", "webm", "m4a", "opus"):
+            path = self.download_dir / f"{stem}.{candidate}"
+            if path.exists():
+                return path
 
         return None
 
@@ -143,18 +143,40 @@ def create_processing_embed(url: str, is_audio: bool = False) -> discord.Embed:
     return embed
 
 
-def create_progress_embed(percent: float, speed: str, eta: str, is_audio: bool = False) -> discord.Embed:
+def _add_video_header(embed: discord.Embed, title: Optional[str], thumbnail: Optional[str]):
+    if title:
+        embed.description = f"**{title}**\n{embed.description}"
+    if thumbnail:
+        embed.set_thumbnail(url=thumbnail)
+
+
+def create_progress_embed(percent: float, speed: str, eta: str, is_audio: bool = False,
+                          phase: str = "download", title: Optional[str] = None,
+                          thumbnail: Optional[str] = None, stream_url: Optional[str] = None,
+                          transcoding: bool = True) -> discord.Embed:
     filled = int(percent / 5)
     bar = "█" * filled + "░" * (20 - filled)
-    action = "🎵 Extracting audio" if is_audio else "📺 Downloading video"
+    if phase == "merge":
+        action = "🔀 Merging video and audio"
+    elif phase == "postprocess":
+        if is_audio:
+            action = "🎛️ Converting to MP3" if transcoding else "🎛️ Finishing audio file"
+        else:
+            action = "🎛️ Post-processing video"
+    else:
+        action = "🎵 Extracting audio" if is_audio else "📺 Downloading video"
     
     embed = discord.Embed(
         title=action,
         description=f"```\n[{bar}] {percent:.1f}%\n```",
         color=0x00FF00 if percent >= 100 else 0xFFAA00,
     )
-    embed.add_field(name="⚡ Speed", value=speed or "...", inline=True)
-    embed.add_field(name="⏱️ ETA", value=eta or "...", inline=True)
+    _add_video_header(embed, title, thumbnail)
+    if phase == "download":
+        embed.add_field(name="⚡ Speed", value=speed or "...", inline=True)
+        embed.add_field(name="⏱️ ETA", value=eta or "...", inline=True)
+    if stream_url:
+        embed.add_field(name="▶️ Stream", value=f"[{'Listen' if is_audio else 'Watch'} while it downloads]({stream_url})", inline=False)
     embed.set_footer(text="YouTube Downloader Bot")
     return embed
 
@@ -167,4 +189,38 @@ def create_success_embed(is_audio: bool = False) -> discord.Embed:
         color=0x00FF00,
     )
     embed.set_footer(text="YouTube Downloader Bot")
-    return embed
\ No newline at end of file
+    return embed
+
+def create_queued_embed(position: int, is_audio: bool = False, title: Optional[str] = None,
+                        thumbnail: Optional[str] = None) -> discord.Embed:
+    action = "🎵 Extracting audio" if is_audio else "📺 Downloading video"
+    embed = discord.Embed(
+        title=action,
+        description=f"```\nQueued - position {position}\n```",
+        color=0x808080,
+    )
+    _add_video_header(embed, title, thumbnail)
+    embed.add_field(name="⏳ Status", value="Waiting for a free download slot", inline=True)
+    embed.set_footer(text="YouTube Downloader Bot")
+    return embed
+
+
+def create_batch_embed(title: str, completed: int, total: int, failed: int = 0, cached: int = 0,
+                       speed: str = "...", is_audio: bool = False, expanding: bool = False) -> discord.Embed:
+    finished = completed + failed
+    percent = finished * 100 / total if total else 0
+    filled = int(percent / 5)
+    bar = "█" * filled + "░" * (20 - filled)
+    action = "🎵 Extracting playlist audio" if is_audio else "📺 Downloading playlist"
+    embed = discord.Embed(
+        title=action,
+        description=f"```\n[{bar}] {finished} of {total}{'+' if expanding else ''}\n```",
+        color=0x00FF00 if total and finished >= total and not expanding else 0xFFAA00,
+    )
+    _add_video_header(embed, title, None)
+    embed.add_field(name="⚡ Speed", value=speed or "...", inline=True)
+    embed.add_field(name="✅ Ready", value=f"{completed} ({cached} cached)", inline=True)
+    if failed:
+        embed.add_field(name="❌ Failed", value=str(failed), inline=True)
+    embed.set_footer(text="YouTube Downloader Bot")
+    return embed
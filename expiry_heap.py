@@ -0,0 +1,38 @@
+import heapq
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+class ExpiryHeap:
+    def __init__(self):
+        self._heap: List[Tuple[float, str]] = []
+        self._deadlines: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def schedule(self, file_uuid: str, deadline: float):
+        with self._lock:
+            self._deadlines[file_uuid] = deadline
+            heapq.heappush(self._heap, (deadline, file_uuid))
+            if len(self._heap) > 2 * len(self._deadlines) + 64:
+                self._heap = [(d, u) for u, d in self._deadlines.items()]
+                heapq.heapify(self._heap)
+
+    def cancel(self, file_uuid: str):
+        with self._lock:
+            self._deadlines.pop(file_uuid, None)
+
+    def deadline(self, file_uuid: str) -> Optional[float]:
+        return self._deadlines.get(file_uuid)
+
+    def pop_expired(self, now: float) -> List[str]:
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, file_uuid = heapq.heappop(self._heap)
+                if self._deadlines.get(file_uuid) == deadline:
+                    del self._deadlines[file_uuid]
+                    expired.append(file_uuid)
+        return expired
@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+from email.utils import formatdate
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+MIME_TYPES = {
+    '.mp4': 'video/mp4',
+    '.mp3': 'audio/mpeg',
+    '.webm': 'video/webm',
+    '.m4a': 'audio/mp4',
+    '.opus': 'audio/ogg',
+}
+
+
+def make_etag(stat: os.stat_result) -> str:
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+class IndexEntry:
+    __slots__ = ('path', 'size', 'mtime', 'mime', 'etag', 'last_modified', 'last_access')
+
+    def __init__(self, path: Path, size: int, mtime: float, mime: str, etag: str):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.mime = mime
+        self.etag = etag
+        self.last_modified = formatdate(mtime, usegmt=True)
+        self.last_access = time.time()
+
+
+class FileIndex:
+    def __init__(self):
+        self._entries: Dict[str, IndexEntry] = {}
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, file_uuid: str, path: Path, etag: Optional[str] = None) -> Optional[IndexEntry]:
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        entry = IndexEntry(path, stat.st_size, stat.st_mtime,
+                           MIME_TYPES.get(path.suffix.lower(), 'application/octet-stream'), etag or make_etag(stat))
+        with self._lock:
+            previous = self._entries.get(file_uuid)
+            self.total_bytes += entry.size - (previous.size if previous else 0)
+            self._entries[file_uuid] = entry
+        return entry
+
+    def get(self, file_uuid: str) -> Optional[IndexEntry]:
+        return self._entries.get(file_uuid)
+
+    def touch(self, file_uuid: str):
+        entry = self._entries.get(file_uuid)
+        if entry:
+            entry.last_access = time.time()
+
+    def items(self) -> List[Tuple[str, IndexEntry]]:
+        with self._lock:
+            return list(self._entries.items())
+
+    def remove(self, file_uuid: str):
+        with self._lock:
+            entry = self._entries.pop(file_uuid, None)
+            if entry:
+                self.total_bytes -= entry.size
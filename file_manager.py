@@ -1,82 +1,291 @@
-import json
-import shutil
+import errno
+import os
+import tempfile
+import threading
+import time
 import uuid
 from pathlib import Path
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterable, Tuple
 from apscheduler.schedulers.background import BackgroundScheduler
 
+from expiry_heap import ExpiryHeap
+from file_index import MIME_TYPES, FileIndex, make_etag
+from metadata_store import open_metadata_store
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+PLACE_RENAME = "rename"
+PLACE_REFLINK = "reflink"
+PLACE_COPY = "copy"
+MTIME_TOLERANCE = 1.0
+
+
+class StorageQuotaError(Exception):
+    pass
+
+
+def _reflink(source: Path, dest: Path) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        with open(source, 'rb') as src, open(dest, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        dest.unlink(missing_ok=True)
+        return False
+
+
+def _copy_chunked(source: Path, dest: Path):
+    with open(source, 'rb') as src, open(dest, 'wb') as dst:
+        copy_range = getattr(os, 'copy_file_range', None)
+        while True:
+            if copy_range:
+                try:
+                    if not copy_range(src.fileno(), dst.fileno(), COPY_CHUNK_SIZE):
+                        break
+                    continue
+                except OSError:
+                    copy_range = None
+                    src.seek(dst.tell())
+            chunk = src.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            dst.write(chunk)
+
+
+def place_file(source: Path, dest: Path) -> str:
+    try:
+        os.replace(source, dest)
+        return PLACE_RENAME
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    partial = dest.with_name(f".{dest.name}.part")
+    try:
+        method = PLACE_REFLINK if _reflink(source, partial) else PLACE_COPY
+        if method == PLACE_COPY:
+            _copy_chunked(source, partial)
+        os.replace(partial, dest)
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+    source.unlink(missing_ok=True)
+    return method
+
+
+def probe_placement(source_dir: Path, dest_dir: Path) -> str:
+    fd, name = tempfile.mkstemp(prefix=".placement-", dir=source_dir)
+    os.close(fd)
+    source = Path(name)
+    dest = dest_dir / source.name
+    try:
+        return place_file(source, dest)
+    finally:
+        source.unlink(missing_ok=True)
+        dest.unlink(missing_ok=True)
+
 
 class FileManager:
-    def __init__(self, upload_dir: str = "./uploads", expiry_hours: int = 24):
+    def __init__(self, upload_dir: str = "./uploads", expiry_hours: int = 24, metadata_backend: str = "sqlite",
+                 expiry_check_seconds: int = 5, max_bytes: int = 0, max_files: int = 0):
         self.upload_dir = Path(upload_dir)
         self.upload_dir.mkdir(parents=True, exist_ok=True)
         self.expiry_hours = expiry_hours
-        self.metadata_file = self.upload_dir / ".metadata.json"
-        self.metadata: Dict[str, Dict[str, Any]] = self._load_metadata()
+        self.store = open_metadata_store(self.upload_dir, metadata_backend)
+        self.expiry_check_seconds = expiry_check_seconds
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.evictions = 0
+        self._budget_lock = threading.Lock()
+        self.index = FileIndex()
+        self.expiry = ExpiryHeap()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.placements = {PLACE_RENAME: 0, PLACE_REFLINK: 0, PLACE_COPY: 0}
         self.scheduler = BackgroundScheduler()
-        self.scheduler.add_job(self.cleanup_expired_files, 'interval', hours=1, id='cleanup_job')
+        self.scheduler.add_job(self.cleanup_expired_files, 'interval', seconds=expiry_check_seconds,
+                               id='cleanup_job', coalesce=True, max_instances=1)
 
     def start_scheduler(self):
         if not self.scheduler.running:
             self.scheduler.start()
-            print(" File cleanup scheduler started (runs every hour)")
+            print(f" File cleanup scheduler started (checks every {self.expiry_check_seconds}s)")
 
     def stop_scheduler(self):
         if self.scheduler.running:
             self.scheduler.shutdown()
 
-    def _load_metadata(self) -> Dict[str, Dict[str, Any]]:
-        if self.metadata_file.exists():
+    def _verify(self, info: Dict[str, Any]) -> Optional[str]:
+        try:
+            stat = (self.upload_dir / info["filename"]).stat()
+        except OSError:
+            return "dangling"
+        if stat.st_size != info.get("size_bytes"):
+            return "mismatched"
+        if info.get("mtime") is not None and abs(stat.st_mtime - info["mtime"]) > MTIME_TOLERANCE:
+            return "mismatched"
+        return None
+
+    def reconcile(self) -> Dict[str, int]:
+        started = time.monotonic()
+        now = time.time()
+        counts = {"kept": 0, "expired": 0, "dangling": 0, "mismatched": 0, "orphaned": 0}
+        dropped = []
+
+        for file_uuid, info in self.store.items():
+            if self.index.get(file_uuid):
+                counts["kept"] += 1
+                continue
+            expires_ts = datetime.fromisoformat(info["expires_at"]).timestamp()
+            problem = "expired" if expires_ts <= now else self._verify(info)
+            if problem:
+                counts[problem] += 1
+                dropped.append(file_uuid)
+                if problem != "dangling":
+                    (self.upload_dir / info["filename"]).unlink(missing_ok=True)
+                continue
+            self.index.add(file_uuid, self.upload_dir / info["filename"], info.get("etag"))
+            self.expiry.schedule(file_uuid, expires_ts)
+            counts["kept"] += 1
+
+        if dropped:
+            self.store.delete_many(dropped)
+
+        for path in self.upload_dir.iterdir():
+            if not path.is_file():
+                continue
             try:
-                with open(self.metadata_file, 'r') as f:
-                    return json.load(f)
-            except Exception:
-                pass
-        return {}
+                stat = path.stat()
+            except OSError:
+                continue
+            # Files touched after reconcile began may be mid-add_file, placed before their store row is written
+            if max(stat.st_mtime, stat.st_ctime) >= now:
+                continue
+            stale = path.name.endswith(".part") or (
+                path.suffix.lower() in MIME_TYPES and not self.index.get(path.stem) and not self.store.get(path.stem)
+            )
+            if stale:
+                path.unlink(missing_ok=True)
+                counts["orphaned"] += 1
+
+        print(f" Reconciled upload store in {time.monotonic() - started:.2f}s: "
+              + ", ".join(f"{count} {name}" for name, count in counts.items()))
+        return counts
+
+    def find_cached(self, video_id: str, mode: str, format_key: str) -> Optional[str]:
+        found = self.store.find(video_id, mode, format_key)
+
+        now = datetime.now()
+        if found and (self.expiry.deadline(found[0]) or 0) > now.timestamp() and self.index.get(found[0]):
+            expires_at = now + timedelta(hours=self.expiry_hours)
+            self.store.set_expiry(found[0], expires_at)
+            self.expiry.schedule(found[0], expires_at.timestamp())
+            return found[0]
+        return None
+
+    def record_lookup(self, hit: bool):
+        if hit:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+
+    def find_video_file(self, video_id: str, format_keys: Iterable[str]) -> Optional[Tuple[Path, Dict[str, Any]]]:
+        now = time.time()
+        for format_key in format_keys:
+            found = self.store.find(video_id, "video", format_key)
+            entry = self.index.get(found[0]) if found else None
+            if entry and (self.expiry.deadline(found[0]) or 0) > now:
+                return entry.path, found[1]
+        return None
+
+    def check_placement(self, source_dir: Path) -> str:
+        method = probe_placement(Path(source_dir), self.upload_dir)
+        if method == PLACE_RENAME:
+            print(f" Storage fast path: {source_dir} and {self.upload_dir} share a filesystem, files are renamed")
+        elif method == PLACE_REFLINK:
+            print(f" Storage fast path: files are reflinked from {source_dir} into {self.upload_dir}")
+        else:
+            print(f" Storage slow path: {source_dir} and {self.upload_dir} are on different filesystems, "
+                  f"every file will be copied. Point DOWNLOAD_DIR at the upload volume to avoid this")
+        return method
+
+    def check_quota(self, estimated_bytes: int):
+        if self.max_bytes and estimated_bytes > self.max_bytes:
+            raise StorageQuotaError(
+                f"File is too large ({estimated_bytes / 1024 ** 2:.0f} MB) for the storage budget "
+                f"({self.max_bytes / 1024 ** 2:.0f} MB)"
+            )
 
-    def _save_metadata(self):
-        with open(self.metadata_file, 'w') as f:
-            json.dump(self.metadata, f, indent=2, default=str)
+    def _make_room(self, incoming_bytes: int):
+        while len(self.index):
+            over_bytes = self.max_bytes and self.index.total_bytes + incoming_bytes > self.max_bytes
+            over_files = self.max_files and len(self.index) + 1 > self.max_files
+            if not (over_bytes or over_files):
+                return
+            now = time.time()
+            victim, entry = max(self.index.items(), key=lambda item: (now - item[1].last_access + 1) * item[1].size)
+            print(f" Evicting {victim} ({entry.size / 1024 ** 2:.1f} MB) to stay within storage budget")
+            self.delete_file(victim)
+            self.index.remove(victim)
+            self.evictions += 1
 
     def add_file(self, source_path: Path, original_filename: str,
-                 video_title: str = "", video_id: str = "") -> Optional[str]:
+                 video_title: str = "", video_id: str = "", mode: str = "",
+                 format_key: str = "", video_info: Optional[Dict[str, Any]] = None,
+                 file_uuid: Optional[str] = None) -> Optional[str]:
         if not source_path.exists():
             return None
 
-        file_uuid = str(uuid.uuid4())
-        new_filename = f"{file_uuid}{source_path.suffix}"
-        dest_path = self.upload_dir / new_filename
+        # Concurrent jobs must not both pass the budget check against the same totals
+        with self._budget_lock:
+            self.check_quota(source_path.stat().st_size)
+            self._make_room(source_path.stat().st_size)
 
-        shutil.move(str(source_path), str(dest_path))
+            file_uuid = file_uuid or str(uuid.uuid4())
+            new_filename = f"{file_uuid}{source_path.suffix}"
+            dest_path = self.upload_dir / new_filename
 
-        now = datetime.now()
-        self.metadata[file_uuid] = {
-            "original_filename": original_filename,
-            "video_title": video_title,
-            "video_id": video_id,
-            "extension": source_path.suffix,
-            "filename": new_filename,
-            "created_at": now.isoformat(),
-            "expires_at": (now + timedelta(hours=self.expiry_hours)).isoformat(),
-            "size_bytes": dest_path.stat().st_size
-        }
-        self._save_metadata()
-        return file_uuid
+            self.placements[place_file(source_path, dest_path)] += 1
+            stat = dest_path.stat()
+
+            now = datetime.now()
+            expires_at = now + timedelta(hours=self.expiry_hours)
+            self.store.put(file_uuid, {
+                "original_filename": original_filename,
+                "video_title": video_title,
+                "video_id": video_id,
+                "extension": source_path.suffix,
+                "filename": new_filename,
+                "created_at": now.isoformat(),
+                "expires_at": expires_at.isoformat(),
+                "size_bytes": stat.st_size,
+                "mtime": stat.st_mtime,
+                "etag": make_etag(stat),
+                "mode": mode,
+                "format": format_key,
+                "video_info": video_info or {}
+            })
+            self.index.add(file_uuid, dest_path, make_etag(stat))
+            self.expiry.schedule(file_uuid, expires_at.timestamp())
+            return file_uuid
 
     def get_file_info(self, file_uuid: str) -> Optional[Dict[str, Any]]:
-        return self.metadata.get(file_uuid)
+        return self.store.get(file_uuid)
 
     def get_file_path(self, file_uuid: str) -> Optional[Path]:
-        info = self.get_file_info(file_uuid)
-        if info:
-            path = self.upload_dir / info["filename"]
-            if path.exists():
-                return path
-        return None
+        entry = self.index.get(file_uuid)
+        return entry.path if entry else None
 
     def delete_file(self, file_uuid: str) -> bool:
-        info = self.metadata.get(file_uuid)
+        info = self.store.get(file_uuid)
         if not info:
             return False
 
@@ -84,44 +293,40 @@ class FileManager:
         if file_path.exists():
             file_path.unlink()
 
-        del self.metadata[file_uuid]
-        self._save_metadata()
+        self.index.remove(file_uuid)
+        self.expiry.cancel(file_uuid)
+        self.store.delete(file_uuid)
         return True
 
     def cleanup_expired_files(self):
-        now = datetime.now()
-        expired = [
-            uid for uid, info in self.metadata.items()
-            if now > datetime.fromisoformat(info["expires_at"])
-        ]
+        expired = self.expiry.pop_expired(datetime.now().timestamp())
+        if not expired:
+            return
 
         for file_uuid in expired:
-            info = self.metadata[file_uuid]
+            info = self.store.get(file_uuid)
+            if not info:
+                continue
             file_path = self.upload_dir / info["filename"]
             if file_path.exists():
                 file_path.unlink()
                 print(f" Deleted expired: {info['video_title']} ({file_uuid})")
-            del self.metadata[file_uuid]
+            self.index.remove(file_uuid)
 
-        if expired:
-            self._save_metadata()
-            print(f" Cleaned up {len(expired)} expired file(s)")
+        self.store.delete_many(expired)
+        print(f" Cleaned up {len(expired)} expired file(s)")
 
     def get_stats(self) -> Dict[str, Any]:
-        total_size = sum(info.get("size_bytes", 0) for info in self.metadata.values())
+        total_size = self.store.total_size()
         return {
-            "total_files": len(self.metadata),
+            "total_files": len(self.store),
             "total_size_mb": round(total_size / (1024 * 1024), 2),
-            "expiry_hours": self.expiry_hours
+            "expiry_hours": self.expiry_hours,
+            "used_bytes": self.index.total_bytes,
+            "max_bytes": self.max_bytes,
+            "max_files": self.max_files,
+            "evictions": self.evictions,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "placements": dict(self.placements)
         }
-
-    def clear_all_files(self):
-        count = 0
-        for file in self.upload_dir.iterdir():
-            if file.suffix.lower() in ['.mp4', '.mp3', '.webm']:
-                file.unlink()
-                count += 1
-        self.metadata.clear()
-        self._save_metadata()
-        if count > 0:
-            print(f" Cleaned up {count} file(s) on startup")
\ No newline at end of file
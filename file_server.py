@@ -1,124 +1,555 @@
+import asyncio
+import functools
+import io
+import json
 import logging
+import os
+import signal
+import subprocess
+import sys
 import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
-from flask import Flask, send_from_directory, abort, Response, request
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
+from aiohttp import web
 
-MIME_TYPES = {
-    '.mp4': 'video/mp4',
-    '.mp3': 'audio/mpeg',
-    '.webm': 'video/webm',
-}
+from bandwidth import BandwidthShaper
+from file_index import MIME_TYPES, FileIndex, IndexEntry
+from metrics import Metrics
+
+CHUNK_SIZE = 256 * 1024
+SENDFILE_CHUNK_SIZE = 1024 * 1024
+GROWING_POLL_INTERVAL = 0.25
+GROWING_STALL_TIMEOUT = 30
+MAX_BUNDLES = 256
+MAX_RANGES = 16
+SHAPED_ROUTES = {'files': False, 'download': True, 'zip': True}
+
+
+class GrowingFile:
+    __slots__ = ('path', 'mime', 'total', 'complete')
+
+    def __init__(self, path: Path, total: Optional[int] = None):
+        self.path = path
+        self.mime = MIME_TYPES.get(path.suffix.lower(), 'application/octet-stream')
+        self.total = total
+        self.complete = False
+
+
+class _ResponseWriter(io.RawIOBase):
+    def __init__(self, write: Callable[[bytes], Awaitable[None]], loop: asyncio.AbstractEventLoop):
+        self._write = write
+        self.loop = loop
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        asyncio.run_coroutine_threadsafe(self._write(bytes(data)), self.loop).result()
+        return len(data)
+
+
+def parse_range_header(header: str) -> Optional[List[Tuple[Optional[int], Optional[int]]]]:
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for spec in specs.split(','):
+        spec = spec.strip()
+        if not spec:
+            continue
+        first, sep, last = spec.partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep or not (first or last) or not (first.isdigit() or not first) or not (last.isdigit() or not last):
+            return None
+        first, last = int(first) if first else None, int(last) if last else None
+        if first is not None and last is not None and last < first:
+            return None
+        ranges.append((first, last))
+    return ranges or None
+
+
+def resolve_ranges(specs: List[Tuple[Optional[int], Optional[int]]], size: int) -> List[Tuple[int, int]]:
+    resolved = []
+    for first, last in specs:
+        if first is None:
+            if last:
+                resolved.append((max(size - last, 0), size - 1))
+        elif first < size:
+            resolved.append((first, size - 1 if last is None else min(last, size - 1)))
+
+    merged: List[Tuple[int, int]] = []
+    for first, last in sorted(resolved):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def _run_worker(upload_dir: str, port: int, domain: str, shaping: dict, parent_pid: int, metrics_port: int = 0):
+    server = FileServer(upload_dir, port, domain, **shaping)
+    server._collect_metrics()
+
+    async def metrics_site(app: web.Application):
+        runner = await server._start_metrics_site(metrics_port)
+        yield
+        await runner.cleanup()
+
+    async def watch_parent(app: web.Application):
+        async def watch():
+            while os.getppid() == parent_pid:
+                await asyncio.sleep(1)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+        task = asyncio.create_task(watch())
+        yield
+        task.cancel()
+
+    server.app.cleanup_ctx.append(watch_parent)
+    if metrics_port:
+        server.app.cleanup_ctx.append(metrics_site)
+    web.run_app(server.app, host='0.0.0.0', port=port, reuse_port=True, print=None)
 
 
 class FileServer:
-    def __init__(self, upload_dir: str = "./uploads", port: int = 3000, domain: str = "http://localhost:3000"):
+    def __init__(self, upload_dir: str = "./uploads", port: int = 3000,
+                 domain: Union[str, Callable[[], str]] = "http://localhost:3000", index: Optional[FileIndex] = None,
+                 rate_limit: float = 0, rate_limit_per_ip: float = 0, rate_limit_per_file: float = 0,
+                 max_connections_per_ip: int = 0, metrics: Optional[Metrics] = None, metrics_port: Optional[int] = None,
+                 max_zip_streams: int = 2):
         self.upload_dir = Path(upload_dir).resolve()
         self.upload_dir.mkdir(parents=True, exist_ok=True)
         self.port = port
-        self.domain = domain.rstrip('/')
-        self.app = Flask(__name__)
-        self.app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024
+        self.metrics_port = metrics_port
+        self._domain = domain if callable(domain) else domain.rstrip('/')
+        self.index = index
+        self._local_index = FileIndex()
+        self._growing: Dict[str, GrowingFile] = {}
+        self._bundles: "OrderedDict[str, Tuple[str, List[Tuple[str, str]]]]" = OrderedDict()
+        self.live_registry = True
+        self._shaping = dict(rate_limit=rate_limit, rate_limit_per_ip=rate_limit_per_ip,
+                             rate_limit_per_file=rate_limit_per_file, max_connections_per_ip=max_connections_per_ip)
+        self.shaper = BandwidthShaper(rate_limit, rate_limit_per_ip, rate_limit_per_file, max_connections_per_ip)
+        self.metrics = metrics or Metrics()
+        self.app = web.Application(middlewares=[self._shape])
+        self._runner: Optional[web.AppRunner] = None
         self._server_thread: Optional[threading.Thread] = None
+        self._workers: List[subprocess.Popen] = []
+        # Zip writers block on every flushed chunk, so they get their own threads instead of the default executor
+        self.zip_executor = ThreadPoolExecutor(max(max_zip_streams, 1), thread_name_prefix="zip")
         self._register_routes()
 
-    def _find_file(self, file_id: str) -> Optional[Path]:
-        file_id_clean = file_id.split('.')[0]
-        for file in self.upload_dir.iterdir():
-            if file.name.startswith(file_id_clean) and not file.name.startswith('.'):
-                return file
+    def _find_file(self, file_id: str) -> Optional[IndexEntry]:
+        file_uuid, _, extension = file_id.partition('.')
+        if not file_uuid or file_uuid.startswith('.'):
+            return None
+
+        if self.index is not None:
+            self.index.touch(file_uuid)
+            return self.index.get(file_uuid)
+
+        entry = self._local_index.get(file_uuid)
+        if entry:
+            return entry
+        for suffix in dict.fromkeys([f".{extension}", *MIME_TYPES] if extension else MIME_TYPES):
+            entry = self._local_index.add(file_uuid, self.upload_dir / f"{file_uuid}{suffix}")
+            if entry:
+                return entry
+        self._local_index.remove(file_uuid)
         return None
 
+    def register_growing(self, file_uuid: str, path: Path, total: Optional[int] = None):
+        self._growing[file_uuid] = GrowingFile(path, total)
+
+    def update_growing(self, file_uuid: str, total: Optional[int]):
+        growing = self._growing.get(file_uuid)
+        if growing and total:
+            growing.total = total
+
+    def finish_growing(self, file_uuid: str):
+        growing = self._growing.pop(file_uuid, None)
+        if growing:
+            growing.complete = True
+
+    def register_bundle(self, name: str, files: List[Tuple[str, str]]) -> str:
+        bundle_id = str(uuid.uuid4())
+        self._bundles[bundle_id] = (name, files)
+        while len(self._bundles) > MAX_BUNDLES:
+            self._bundles.popitem(last=False)
+        return bundle_id
+
     def _register_routes(self):
-        @self.app.route('/files/<path:file_id>')
-        def serve_file(file_id: str):
-            file = self._find_file(file_id)
-            if not file:
-                abort(404)
+        self.app.router.add_get('/files/{file_id}', self.serve_file)
+        self.app.router.add_get('/download/{file_id}', self.download_file)
+        self.app.router.add_get('/zip/{bundle_id}', self.download_bundle)
+        self.app.router.add_get('/health', self.health_check)
+
+    def _collect_metrics(self):
+        self.metrics.collect("bytes_served_total", lambda: self.shaper.meter.total, kind="counter")
+        self.metrics.collect("egress_bytes_per_second", lambda: self.shaper.meter.rate)
+        self.metrics.collect("connections", lambda: self.shaper.connections)
+        self.metrics.collect("connections_rejected_total", lambda: self.shaper.rejected, kind="counter")
+        self.metrics.collect("growing_files", lambda: len(self._growing))
+
+    @web.middleware
+    async def _shape(self, request: web.Request, handler) -> web.StreamResponse:
+        kind = request.path.split('/', 2)[1]
+        if kind not in SHAPED_ROUTES:
+            return await handler(request)
+
+        key = request.match_info.get('file_id') or request.match_info.get('bundle_id') or ''
+        flow = self.shaper.open(request.remote or '', key.partition('.')[0], kind, bulk=SHAPED_ROUTES[kind])
+        if flow is None:
+            return web.json_response({"error": "Too many connections"}, status=429, headers={'Retry-After': '5'})
+        request['flow'] = flow
+        try:
+            return await handler(request)
+        finally:
+            self.shaper.close(flow)
+
+    async def _account(self, request: web.Request, amount: int):
+        flow = request.get('flow')
+        if flow is not None:
+            await self.shaper.throttle(flow, amount)
+
+    async def _write(self, request: web.Request, response: web.StreamResponse, data: bytes):
+        await self._account(request, len(data))
+        await response.write(data)
+
+    def bandwidth_stats(self) -> Dict[str, object]:
+        return self.shaper.stats()
+
+    @staticmethod
+    def _not_found() -> web.Response:
+        return web.json_response({"error": "File not found or expired"}, status=404)
+
+    async def serve_file(self, request: web.Request) -> web.StreamResponse:
+        entry = self._find_file(request.match_info['file_id'])
+        if not entry:
+            growing = self._growing.get(request.match_info['file_id'].partition('.')[0])
+            if growing:
+                return await self._serve_growing(request, growing)
+            return self._not_found()
 
-            mimetype = MIME_TYPES.get(file.suffix.lower(), 'application/octet-stream')
-            file_size = file.stat().st_size
-            range_header = request.headers.get('Range')
+        headers = {
+            'X-Content-Type-Options': 'nosniff',
+            'Content-Disposition': f'inline; filename="{entry.path.name}"',
+            'Cache-Control': 'public, max-age=3600',
+        }
+        return await self._serve_entry(request, entry, headers)
 
+    async def download_file(self, request: web.Request) -> web.StreamResponse:
+        entry = self._find_file(request.match_info['file_id'])
+        if not entry:
+            return self._not_found()
+
+        headers = {
+            'Content-Disposition': f'attachment; filename="{entry.path.name}"',
+        }
+        return await self._serve_entry(request, entry, headers)
+
+    async def download_bundle(self, request: web.Request) -> web.StreamResponse:
+        bundle = self._bundles.get(request.match_info['bundle_id'].partition('.')[0])
+        if not bundle:
+            return self._not_found()
+
+        name, files = bundle
+        entries = [(entry.path, arcname) for file_uuid, arcname in files if (entry := self._find_file(file_uuid))]
+        if not entries:
+            return self._not_found()
+
+        response = web.StreamResponse(headers={'Content-Disposition': f'attachment; filename="{name}.zip"'})
+        response.content_type = 'application/zip'
+        await response.prepare(request)
+        if request.method != 'HEAD':
+            write = functools.partial(self._write, request, response)
+            writer = io.BufferedWriter(_ResponseWriter(write, asyncio.get_running_loop()), CHUNK_SIZE)
+            await asyncio.get_running_loop().run_in_executor(self.zip_executor, self._write_zip, writer, entries)
+        await response.write_eof()
+        return response
+
+    @staticmethod
+    def _write_zip(writer: io.BufferedWriter, entries: List[Tuple[Path, str]]):
+        with writer, zipfile.ZipFile(writer, 'w', zipfile.ZIP_STORED) as archive:
+            for path, arcname in entries:
+                try:
+                    archive.write(path, arcname)
+                except FileNotFoundError:
+                    continue
+
+    async def health_check(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "upload_dir": str(self.upload_dir), "bandwidth": self.bandwidth_stats()})
+
+    async def serve_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.metrics.render().encode(),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    @staticmethod
+    def _not_modified(request: web.Request, entry: IndexEntry) -> bool:
+        if 'If-None-Match' in request.headers:
+            return any(tag.value in ('*', entry.etag) for tag in request.if_none_match or ())
+        since = request.if_modified_since
+        return since is not None and int(entry.mtime) <= since.timestamp()
+
+    @staticmethod
+    def _range_applies(request: web.Request, entry: IndexEntry) -> bool:
+        if_range = request.headers.get('If-Range', '').strip()
+        if not if_range:
+            return True
+        if if_range.startswith('"'):
+            return if_range == f'"{entry.etag}"'
+        since = request.if_range
+        return since is not None and int(entry.mtime) == int(since.timestamp())
+
+    async def _serve_entry(self, request: web.Request, entry: IndexEntry, base_headers: dict) -> web.StreamResponse:
+        headers = {
+            **base_headers,
+            'Accept-Ranges': 'bytes',
+            'ETag': f'"{entry.etag}"',
+            'Last-Modified': entry.last_modified,
+        }
+        if self._not_modified(request, entry):
+            return web.Response(status=304, headers=headers)
+
+        range_header = request.headers.get('Range')
+        specs = parse_range_header(range_header) if range_header and self._range_applies(request, entry) else None
+        if not specs or len(specs) > MAX_RANGES:
+            return await self._send(request, entry, [(0, entry.size - 1)], 200, headers)
+
+        ranges = resolve_ranges(specs, entry.size)
+        if not ranges:
+            headers['Content-Range'] = f'bytes */{entry.size}'
+            return web.Response(text="Requested range not satisfiable", status=416, headers=headers)
+        if len(ranges) == 1:
+            headers['Content-Range'] = f'bytes {ranges[0][0]}-{ranges[0][1]}/{entry.size}'
+        return await self._send(request, entry, ranges, 206, headers)
+
+    async def _serve_growing(self, request: web.Request, growing: GrowingFile) -> web.StreamResponse:
+        start, end = 0, None
+        specs = parse_range_header(request.headers.get('Range', ''))
+        ranged = specs is not None and len(specs) == 1 and (specs[0][0] is not None or bool(growing.total))
+        if ranged:
+            start, end = specs[0]
+
+        f = await self._open_growing(growing)
+        if f is None:
+            return self._not_found()
+
+        with f:
             headers = {
                 'Accept-Ranges': 'bytes',
-                'Content-Length': file_size,
                 'X-Content-Type-Options': 'nosniff',
-                'Content-Disposition': f'inline; filename="{file.name}"',
-                'Cache-Control': 'public, max-age=3600',
-                'ETag': f'"{file.stat().st_mtime}-{file_size}"',
+                'Content-Disposition': f'inline; filename="{growing.path.name}"',
+                'Cache-Control': 'no-store',
             }
+            total = growing.total
+            if total:
+                if ranged:
+                    ranges = resolve_ranges(specs, total)
+                    if not ranges:
+                        headers['Content-Range'] = f'bytes */{total}'
+                        return web.Response(text="Requested range not satisfiable", status=416, headers=headers)
+                    start, end = ranges[0]
+                    headers['Content-Range'] = f'bytes {start}-{end}/{total}'
+                else:
+                    end = total - 1
+            elif ranged:
+                available = await self._wait_for_bytes(growing, f, start + 1)
+                if available <= start:
+                    return web.Response(text="Requested range not satisfiable", status=416)
+                end = min(end if end is not None else available - 1, available - 1)
+                headers['Content-Range'] = f'bytes {start}-{end}/*'
 
-            if range_header:
-                return self._serve_range(file, file_size, mimetype, range_header, headers)
-
-            def generate():
-                with open(file, 'rb') as f:
-                    while chunk := f.read(65536):
-                        yield chunk
-
-            response = Response(generate(), mimetype=mimetype)
-            response.headers.update(headers)
-            return response
-
-        @self.app.route('/download/<path:file_id>')
-        def download_file(file_id: str):
-            file = self._find_file(file_id)
-            if not file:
-                abort(404)
-            return send_from_directory(self.upload_dir, file.name, as_attachment=True)
-
-        @self.app.route('/health')
-        def health_check():
-            return {"status": "ok", "upload_dir": str(self.upload_dir)}
-
-        @self.app.errorhandler(404)
-        def not_found(e):
-            return {"error": "File not found or expired"}, 404
-
-    def _serve_range(self, file: Path, file_size: int, mimetype: str, range_header: str, base_headers: dict) -> Response:
-        byte_range = range_header.replace('bytes=', '').split('-')
-        start = int(byte_range[0]) if byte_range[0] else 0
-        end = int(byte_range[1]) if byte_range[1] else file_size - 1
-
-        if start >= file_size:
-            return Response("Requested range not satisfiable", status=416)
-
-        end = min(end, file_size - 1)
-        length = end - start + 1
-
-        def generate():
-            with open(file, 'rb') as f:
-                f.seek(start)
-                remaining = length
-                while remaining > 0:
-                    chunk_size = min(65536, remaining)
-                    chunk = f.read(chunk_size)
-                    if not chunk:
-                        break
-                    remaining -= len(chunk)
-                    yield chunk
-
-        response = Response(generate(), status=206, mimetype=mimetype)
-        response.headers.update(base_headers)
-        response.headers.update({
-            'Content-Range': f'bytes {start}-{end}/{file_size}',
-            'Content-Length': length,
-        })
+            response = web.StreamResponse(status=206 if ranged else 200, headers=headers)
+            response.content_type = growing.mime
+            if end is not None:
+                response.content_length = end - start + 1
+            await response.prepare(request)
+
+            if request.method != 'HEAD':
+                await self._stream_growing(request, response, growing, f, start, end)
+            await response.write_eof()
         return response
 
+    async def _open_growing(self, growing: GrowingFile):
+        deadline = time.monotonic() + GROWING_STALL_TIMEOUT
+        while True:
+            try:
+                return open(growing.path, 'rb')
+            except FileNotFoundError:
+                if growing.complete or time.monotonic() > deadline:
+                    return None
+                await asyncio.sleep(GROWING_POLL_INTERVAL)
+
+    @staticmethod
+    async def _wait_for_bytes(growing: GrowingFile, f, needed: int) -> int:
+        deadline = time.monotonic() + GROWING_STALL_TIMEOUT
+        while True:
+            available = os.fstat(f.fileno()).st_size
+            if available >= needed or growing.complete or time.monotonic() > deadline:
+                return available
+            await asyncio.sleep(GROWING_POLL_INTERVAL)
+
+    async def _stream_growing(self, request: web.Request, response: web.StreamResponse, growing: GrowingFile, f,
+                              position: int, end: Optional[int]):
+        loop = asyncio.get_running_loop()
+        while end is None or position <= end:
+            available = await self._wait_for_bytes(growing, f, position + 1)
+            if available <= position:
+                break
+            f.seek(position)
+            limit = available if end is None else min(available, end + 1)
+            chunk = await loop.run_in_executor(None, f.read, min(CHUNK_SIZE, limit - position))
+            if not chunk:
+                break
+            position += len(chunk)
+            await self._write(request, response, chunk)
+
+    async def _send(self, request: web.Request, entry: IndexEntry, ranges: List[Tuple[int, int]],
+                    status: int, headers: dict) -> web.StreamResponse:
+        try:
+            f = open(entry.path, 'rb')
+        except FileNotFoundError:
+            if self.index is None:
+                self._local_index.remove(entry.path.stem)
+            return self._not_found()
+
+        with f:
+            response = web.StreamResponse(status=status, headers=headers)
+            if len(ranges) == 1:
+                parts = [(b"", ranges[0][0], ranges[0][1] - ranges[0][0] + 1)]
+                closing = b""
+                response.content_type = entry.mime
+            else:
+                boundary = uuid.uuid4().hex
+                parts = [(f"--{boundary}\r\nContent-Type: {entry.mime}\r\n"
+                          f"Content-Range: bytes {first}-{last}/{entry.size}\r\n\r\n".encode(), first, last - first + 1)
+                         for first, last in ranges]
+                parts = [(head if index == 0 else b"\r\n" + head, first, count)
+                         for index, (head, first, count) in enumerate(parts)]
+                closing = f"\r\n--{boundary}--\r\n".encode()
+                response.headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+            response.content_length = sum(len(head) + count for head, _, count in parts) + len(closing)
+            await response.prepare(request)
+
+            if request.method != 'HEAD':
+                for head, offset, count in parts:
+                    if head:
+                        await response.write(head)
+                    if count > 0:
+                        await self._sendfile(request, response, f, offset, count)
+                if closing:
+                    await response.write(closing)
+            await response.write_eof()
+        return response
+
+    async def _sendfile(self, request: web.Request, response: web.StreamResponse, f, offset: int, count: int):
+        loop = asyncio.get_running_loop()
+        transport = request.transport
+        if transport is None:
+            raise ConnectionResetError("Connection lost")
+
+        prepaid = 0
+        try:
+            while count > 0:
+                size = min(SENDFILE_CHUNK_SIZE, count)
+                await self._account(request, size)
+                prepaid = size
+                await loop.sendfile(transport, f, offset, size)
+                prepaid = 0
+                offset += size
+                count -= size
+            return
+        except NotImplementedError:
+            pass
+
+        f.seek(offset)
+        while count > 0:
+            chunk = await loop.run_in_executor(None, f.read, min(CHUNK_SIZE, count))
+            if not chunk:
+                break
+            count -= len(chunk)
+            if prepaid > 0:
+                prepaid -= len(chunk)
+                await response.write(chunk)
+            else:
+                await self._write(request, response, chunk)
+
+    @property
+    def domain(self) -> str:
+        if callable(self._domain):
+            self._domain = self._domain().rstrip('/')
+        return self._domain
+
     def get_file_url(self, file_uuid: str, download: bool = False, extension: str = ".mp4") -> str:
         endpoint = "download" if download else "files"
         return f"{self.domain}/{endpoint}/{file_uuid}{extension}"
 
-    def start(self, threaded: bool = True):
-        if threaded:
+    def get_bundle_url(self, bundle_id: str) -> str:
+        return f"{self.domain}/zip/{bundle_id}.zip"
+
+    async def start(self, mode: str = "loop", workers: int = 1):
+        self.live_registry = mode != "workers"
+        if mode == "workers":
+            # A fresh interpreter on this module, so workers never re-run the bot's entry script
+            cwd = Path(__file__).resolve().parent
+            for number in range(1, max(workers, 1) + 1):
+                worker_metrics_port = self.metrics_port + number if self.metrics_port else 0
+                command = [sys.executable, '-m', 'file_server', str(self.upload_dir), str(self.port), self.domain,
+                           json.dumps(self._shaping), str(os.getpid()), str(worker_metrics_port)]
+                self._workers.append(subprocess.Popen(command, cwd=cwd))
+            print(f" File server started on port {self.port} ({len(self._workers)} worker processes)")
+            if self.metrics_port:
+                self._runner = await self._start_metrics_site(self.metrics_port)
+                print(f" Metrics served on port {self.metrics_port} (bot), "
+                      f"{self.metrics_port + 1}-{self.metrics_port + len(self._workers)} (file server workers)")
+            return
+
+        self._collect_metrics()
+        self.app.router.add_get('/metrics', self.serve_metrics)
+        if mode == "thread":
             self._server_thread = threading.Thread(target=self._run_server, daemon=True)
             self._server_thread.start()
-            print(f" File server started at {self.domain}")
+            print(f" File server started on port {self.port}")
         else:
-            self._run_server()
+            await self._start_site()
+            print(f" File server started on port {self.port}")
+
+    async def _start_site(self):
+        logging.getLogger('aiohttp.access').setLevel(logging.WARNING)
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host='0.0.0.0', port=self.port)
+        await site.start()
+
+    async def _start_metrics_site(self, port: int) -> web.AppRunner:
+        app = web.Application()
+        app.router.add_get('/metrics', self.serve_metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host='0.0.0.0', port=port)
+        await site.start()
+        return runner
 
     def _run_server(self):
-        logging.getLogger('werkzeug').setLevel(logging.WARNING)
-        self.app.run(host='0.0.0.0', port=self.port, debug=False, use_reloader=False)
\ No newline at end of file
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(self._start_site())
+        loop.run_forever()
+
+    async def stop(self):
+        if self._runner and self._server_thread is None:
+            await self._runner.cleanup()
+        for process in self._workers:
+            process.terminate()
+        self.zip_executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    _upload_dir, _port, _domain, _shaping, _parent_pid, _metrics_port = sys.argv[1:7]
+    _run_worker(_upload_dir, int(_port), _domain, json.loads(_shaping), int(_parent_pid), int(_metrics_port))
@@ -0,0 +1,75 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class InflightJob:
+    def __init__(self):
+        self.subscribers: List[asyncio.Queue] = []
+        self.last_progress: Optional[Tuple] = None
+        self.stream: Optional[Tuple] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        if self.stream:
+            queue.put_nowait(self.stream)
+        if self.last_progress:
+            queue.put_nowait(self.last_progress)
+        self.subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self.subscribers:
+            self.subscribers.remove(queue)
+        if not self.subscribers and self.task and not self.task.done():
+            self.task.cancel()
+
+    def publish(self, update: Tuple):
+        if update[0] in ('progress', 'queued'):
+            self.last_progress = update
+        elif update[0] == 'stream':
+            self.stream = update
+        for queue in self.subscribers:
+            queue.put_nowait(update)
+
+
+class SingleFlight:
+    def __init__(self, on_error: Optional[Callable[[Exception], None]] = None):
+        self._jobs: Dict[Hashable, InflightJob] = {}
+        self.on_error = on_error
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def leave(self, key: Hashable, queue: asyncio.Queue):
+        job = self._jobs.get(key)
+        if job:
+            job.unsubscribe(queue)
+
+    def cancel_all(self):
+        for job in list(self._jobs.values()):
+            if job.task and not job.task.done():
+                job.task.cancel()
+
+    def join(self, key: Hashable, factory: Callable[[InflightJob], Awaitable[Any]]) -> Tuple[asyncio.Queue, bool]:
+        job = self._jobs.get(key)
+        attached = job is not None
+        if not attached:
+            job = InflightJob()
+            self._jobs[key] = job
+            job.task = asyncio.create_task(self._run(key, job, factory))
+        return job.subscribe(), attached
+
+    async def _run(self, key: Hashable, job: InflightJob, factory: Callable[[InflightJob], Awaitable[Any]]):
+        try:
+            result = await factory(job)
+            job.publish(('ready', *result))
+        except asyncio.CancelledError:
+            job.publish(('error', "Download cancelled"))
+            raise
+        except Exception as e:
+            if self.on_error:
+                self.on_error(e)
+            job.publish(('error', str(e)))
+        finally:
+            self._jobs.pop(key, None)
@@ -0,0 +1,211 @@
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+
+def _expiry_ts(info: Dict[str, Any]) -> float:
+    return datetime.fromisoformat(info["expires_at"]).timestamp()
+
+
+class MetadataStore(ABC):
+    @abstractmethod
+    def get(self, file_uuid: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def put(self, file_uuid: str, info: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    def delete_many(self, file_uuids: Iterable[str]):
+        ...
+
+    def delete(self, file_uuid: str):
+        self.delete_many([file_uuid])
+
+    @abstractmethod
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        ...
+
+    @abstractmethod
+    def find(self, video_id: str, mode: str, format_key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        ...
+
+    def set_expiry(self, file_uuid: str, expires_at: datetime):
+        info = self.get(file_uuid)
+        if info:
+            info["expires_at"] = expires_at.isoformat()
+            self.put(file_uuid, info)
+
+    def total_size(self) -> int:
+        return sum(info.get("size_bytes", 0) for _, info in self.items())
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.items())
+
+
+class JsonMetadataStore(MetadataStore):
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._data: Dict[str, Dict[str, Any]] = self._load()
+        self._by_video: Dict[Tuple[str, str, str], str] = {}
+        for file_uuid, info in self._data.items():
+            self._by_video[self._video_key(info)] = file_uuid
+
+    @staticmethod
+    def _video_key(info: Dict[str, Any]) -> Tuple[str, str, str]:
+        return info.get("video_id", ""), info.get("mode", ""), info.get("format", "")
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self.path.exists():
+            try:
+                with open(self.path, 'r') as f:
+                    return json.load(f)
+            except Exception:
+                pass
+        return {}
+
+    def _save(self):
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self._data, f, default=str)
+        os.replace(tmp_path, self.path)
+
+    def get(self, file_uuid: str) -> Optional[Dict[str, Any]]:
+        info = self._data.get(file_uuid)
+        return dict(info) if info else None
+
+    def put(self, file_uuid: str, info: Dict[str, Any]):
+        with self._lock:
+            self._data[file_uuid] = dict(info)
+            self._by_video[self._video_key(info)] = file_uuid
+            self._save()
+
+    def delete_many(self, file_uuids: Iterable[str]):
+        with self._lock:
+            for file_uuid in file_uuids:
+                info = self._data.pop(file_uuid, None)
+                if info and self._by_video.get(self._video_key(info)) == file_uuid:
+                    del self._by_video[self._video_key(info)]
+            self._save()
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            snapshot = list(self._data.items())
+        return iter(snapshot)
+
+    def find(self, video_id: str, mode: str, format_key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        file_uuid = self._by_video.get((video_id, mode, format_key))
+        info = self.get(file_uuid) if file_uuid else None
+        return (file_uuid, info) if info else None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SqliteMetadataStore(MetadataStore):
+    def __init__(self, path: Path, legacy_json: Optional[Path] = None):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    uuid TEXT PRIMARY KEY,
+                    video_id TEXT NOT NULL DEFAULT '',
+                    mode TEXT NOT NULL DEFAULT '',
+                    format TEXT NOT NULL DEFAULT '',
+                    expires_ts REAL NOT NULL,
+                    size_bytes INTEGER NOT NULL DEFAULT 0,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS files_video ON files (video_id, mode, format);
+                CREATE INDEX IF NOT EXISTS files_expiry ON files (expires_ts);
+            """)
+        if legacy_json and legacy_json.exists() and len(self) == 0:
+            self._import_json(legacy_json)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _import_json(self, legacy_json: Path):
+        entries = JsonMetadataStore(legacy_json).items()
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [self._row(file_uuid, info) for file_uuid, info in entries]
+            )
+        legacy_json.rename(legacy_json.with_suffix('.json.migrated'))
+        print(f" Migrated {len(self)} metadata entries from {legacy_json.name}")
+
+    @staticmethod
+    def _row(file_uuid: str, info: Dict[str, Any]) -> tuple:
+        return (
+            file_uuid,
+            info.get("video_id", ""),
+            info.get("mode", ""),
+            info.get("format", ""),
+            _expiry_ts(info),
+            info.get("size_bytes", 0),
+            json.dumps(info, default=str),
+        )
+
+    def get(self, file_uuid: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT data FROM files WHERE uuid = ?", (file_uuid,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, file_uuid: str, info: Dict[str, Any]):
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", self._row(file_uuid, info))
+
+    def delete_many(self, file_uuids: Iterable[str]):
+        with self._conn() as conn:
+            conn.executemany("DELETE FROM files WHERE uuid = ?", [(file_uuid,) for file_uuid in file_uuids])
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        for file_uuid, data in self._conn().execute("SELECT uuid, data FROM files"):
+            yield file_uuid, json.loads(data)
+
+    def find(self, video_id: str, mode: str, format_key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        row = self._conn().execute(
+            "SELECT uuid, data FROM files WHERE video_id = ? AND mode = ? AND format = ? "
+            "ORDER BY expires_ts DESC LIMIT 1",
+            (video_id, mode, format_key)
+        ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def set_expiry(self, file_uuid: str, expires_at: datetime):
+        info = self.get(file_uuid)
+        if not info:
+            return
+        info["expires_at"] = expires_at.isoformat()
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE files SET expires_ts = ?, data = ? WHERE uuid = ?",
+                (expires_at.timestamp(), json.dumps(info, default=str), file_uuid)
+            )
+
+    def total_size(self) -> int:
+        return self._conn().execute("SELECT COALESCE(SUM(size_bytes), 0) FROM files").fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+
+def open_metadata_store(upload_dir: Path, backend: str = "sqlite") -> MetadataStore:
+    legacy_json = upload_dir / ".metadata.json"
+    if backend == "json":
+        print(" METADATA_BACKEND=json rewrites the whole file on every change; use it only with existing legacy setups")
+        return JsonMetadataStore(legacy_json)
+    return SqliteMetadataStore(upload_dir / ".metadata.db", legacy_json=legacy_json)
@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    def __init__(self, namespace: str = "ytbot"):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = defaultdict(float)
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._collectors: List[Tuple[str, str, Callable[[], float]]] = []
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, object]) -> Tuple[str, Labels]:
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        with self._lock:
+            self.counters[self._key(name, labels)] += value
+
+    def get(self, name: str, **labels) -> float:
+        return self.counters.get(self._key(name, labels), 0)
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def collect(self, name: str, func: Callable[[], float], kind: str = "gauge"):
+        self._collectors.append((name, kind, func))
+
+    def render(self) -> str:
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(h.counts), h.sum, h.count, h.buckets)) for key, h in self.histograms.items())
+
+        lines = []
+        typed = set()
+
+        def declare(name: str, kind: str):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            metric = f"{self.namespace}_{name}"
+            declare(metric, "counter")
+            lines.append(f"{metric}{_format_labels(labels)} {_format_value(value)}")
+
+        for (name, labels), (counts, total, count, buckets) in histograms:
+            metric = f"{self.namespace}_{name}"
+            declare(metric, "histogram")
+            for bound, bucket_count in zip(buckets, counts):
+                lines.append(f"{metric}_bucket{_format_labels(labels + (('le', f'{bound:g}'),))} {bucket_count}")
+            lines.append(f"{metric}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {count}")
+
+        for name, kind, func in self._collectors:
+            try:
+                value = func()
+            except Exception:
+                continue
+            metric = f"{self.namespace}_{name}"
+            declare(metric, kind)
+            lines.append(f"{metric} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+class StageTimer:
+    def __init__(self, metrics: Metrics, name: str = "stage_seconds"):
+        self.metrics = metrics
+        self.name = name
+        self.stage: Optional[str] = None
+        self._started = 0.0
+        self._seen = set()
+
+    def enter(self, stage: Optional[str]):
+        if stage == self.stage or stage in self._seen:
+            return
+        now = time.monotonic()
+        if self.stage is not None:
+            self.metrics.observe(self.name, now - self._started, stage=self.stage)
+        self._seen.add(stage)
+        self.stage, self._started = stage, now
+
+    def stop(self):
+        self.enter(None)
@@ -0,0 +1,231 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+PHASE_DOWNLOAD = "download"
+PHASE_MERGE = "merge"
+PHASE_POSTPROCESS = "postprocess"
+
+
+def format_speed(speed: Optional[float]) -> str:
+    if not speed:
+        return "..."
+    speed = float(speed)
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if speed < 1024 or unit == "GiB":
+            return f"{speed:.2f}{unit}/s"
+        speed /= 1024
+
+
+class ProgressEvent:
+    __slots__ = ('phase', 'status', 'downloaded_bytes', 'total_bytes', 'total_exact', 'speed', 'eta', 'filename',
+                 'postprocessor')
+
+    def __init__(self, phase: str, status: str = "", downloaded_bytes: int = 0, total_bytes: Optional[int] = None,
+                 speed: Optional[float] = None, eta: Optional[float] = None, filename: str = "",
+                 postprocessor: str = "", total_exact: bool = False):
+        self.phase = phase
+        self.status = status
+        self.downloaded_bytes = downloaded_bytes
+        self.total_bytes = total_bytes
+        self.total_exact = total_exact
+        self.speed = speed
+        self.eta = eta
+        self.filename = filename
+        self.postprocessor = postprocessor
+
+    @classmethod
+    def from_download(cls, d: Dict[str, Any]) -> "ProgressEvent":
+        return cls(
+            PHASE_DOWNLOAD,
+            status=d.get('status') or "",
+            downloaded_bytes=d.get('downloaded_bytes') or 0,
+            total_bytes=d.get('total_bytes') or d.get('total_bytes_estimate'),
+            total_exact=bool(d.get('total_bytes')),
+            speed=d.get('speed'),
+            eta=d.get('eta'),
+            filename=d.get('filename') or "",
+        )
+
+    @classmethod
+    def from_postprocess(cls, d: Dict[str, Any]) -> "ProgressEvent":
+        postprocessor = d.get('postprocessor') or ""
+        return cls(
+            PHASE_MERGE if postprocessor == "Merger" else PHASE_POSTPROCESS,
+            status=d.get('status') or "",
+            postprocessor=postprocessor,
+        )
+
+    @property
+    def percent(self) -> Optional[float]:
+        if self.phase != PHASE_DOWNLOAD:
+            return 100.0 if self.status == "finished" else None
+        if not self.total_bytes:
+            return None
+        return min(self.downloaded_bytes * 100 / self.total_bytes, 100.0)
+
+    @property
+    def exact_total(self) -> Optional[int]:
+        return self.total_bytes if self.total_exact else None
+
+    @property
+    def speed_str(self) -> str:
+        return format_speed(self.speed)
+
+    @property
+    def eta_str(self) -> str:
+        if self.eta is None:
+            return "..."
+        minutes, seconds = divmod(int(self.eta), 60)
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+
+class ProgressThrottle:
+    def __init__(self, min_step: float = 5, min_interval: float = 1.0):
+        self.min_step = min_step
+        self.min_interval = min_interval
+        self._stage = None
+        self._last_percent = -1.0
+        self._last_update = 0.0
+
+    def allow(self, event: ProgressEvent) -> bool:
+        now = time.monotonic()
+        stage = (event.phase, event.filename, event.postprocessor)
+        percent = event.percent
+
+        if stage != self._stage:
+            allowed = True
+        elif event.phase != PHASE_DOWNLOAD:
+            allowed = event.status == "finished"
+        elif percent is None:
+            allowed = now - self._last_update >= self.min_interval
+        else:
+            allowed = percent >= 99 or (percent >= self._last_percent + self.min_step
+                                        and now - self._last_update >= self.min_interval)
+
+        if allowed:
+            self._stage = stage
+            self._last_percent = percent or 0.0
+            self._last_update = now
+        return allowed
+
+
+class BatchProgress:
+    def __init__(self, title: str = ""):
+        self.title = title
+        self.expanding = True
+        self.entries: List[Dict[str, Any]] = []
+        self._speeds: Dict[int, float] = {}
+
+    @property
+    def total(self) -> int:
+        return len(self.entries)
+
+    @property
+    def completed(self) -> int:
+        return sum(1 for entry in self.entries if entry.get('file_uuid'))
+
+    @property
+    def failed(self) -> int:
+        return sum(1 for entry in self.entries if entry.get('error'))
+
+    @property
+    def cached(self) -> int:
+        return sum(1 for entry in self.entries if entry.get('cached'))
+
+    @property
+    def speed(self) -> float:
+        return sum(self._speeds.values())
+
+    def add(self, entry: Dict[str, Any]) -> int:
+        self.entries.append({'url': entry.get('url'), 'title': entry.get('title') or entry.get('id') or entry.get('url')})
+        if not self.title:
+            self.title = entry.get('playlist_title') or ""
+        return len(self.entries) - 1
+
+    def update(self, index: int, event: ProgressEvent):
+        self._speeds[index] = (event.speed or 0) if event.phase == PHASE_DOWNLOAD else 0
+
+    def finish(self, index: int, metadata: Dict[str, Any], file_uuid: str, cached: bool = False):
+        self._speeds.pop(index, None)
+        self.entries[index].update(title=metadata.get('title') or self.entries[index]['title'],
+                                   metadata=metadata, file_uuid=file_uuid, cached=cached)
+
+    def fail(self, index: int, error: str):
+        self._speeds.pop(index, None)
+        self.entries[index]['error'] = error
+
+
+class EditPacer:
+    def __init__(self, rate: float = 5.0, burst: int = 5):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ProgressPublisher:
+    def __init__(self, message: Any, pacer: EditPacer, min_interval: float = 1.0):
+        self.message = message
+        self.pacer = pacer
+        self.min_interval = min_interval
+        self.edits = 0
+        self.skipped = 0
+        self._latest = None
+        self._last_sent: Optional[dict] = None
+        self._last_sent_at = 0.0
+        self._closed = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def publish(self, embed):
+        self._latest = embed
+        self._wakeup.set()
+
+    async def _send(self, embed):
+        payload = embed.to_dict()
+        if payload == self._last_sent:
+            self.skipped += 1
+            return
+        await self.pacer.acquire()
+        try:
+            await self.message.edit(embed=embed)
+        except Exception:
+            pass
+        self._last_sent = payload
+        self._last_sent_at = time.monotonic()
+        self.edits += 1
+
+    async def _run(self):
+        while not self._closed:
+            await self._wakeup.wait()
+            wait = self._last_sent_at + self.min_interval - time.monotonic()
+            if wait > 0 and not self._closed:
+                await asyncio.sleep(wait)
+            self._wakeup.clear()
+            if self._closed:
+                break
+            embed, self._latest = self._latest, None
+            if embed is not None:
+                await self._send(embed)
+
+    async def close(self, final_embed=None):
+        self._closed = True
+        self._wakeup.set()
+        await self._task
+        embed = final_embed if final_embed is not None else self._latest
+        if embed is not None:
+            await self._send(embed)
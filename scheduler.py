@@ -0,0 +1,157 @@
+import asyncio
+import itertools
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class _Ticket:
+    def __init__(self, seq: int, kind: str, user_id: Optional[int], guild_id: Optional[int],
+                 on_position: Optional[Callable[[int], None]], cost: int = 0):
+        self.seq = seq
+        self.kind = kind
+        self.cost = cost
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.on_position = on_position
+        self.position = 0
+        self.future: Optional[asyncio.Future] = None
+
+
+class DownloadScheduler:
+    def __init__(self, max_concurrent: int = 4, kind_limits: Optional[Dict[str, int]] = None,
+                 max_per_user: int = 2, max_per_guild: int = 3, max_queue: int = 50,
+                 cost_unit: int = 256 * 1024 * 1024, max_cost_penalty: int = 5):
+        self.max_concurrent = max_concurrent
+        self.kind_limits = kind_limits or {}
+        self.max_per_user = max_per_user
+        self.max_per_guild = max_per_guild
+        self.max_queue = max_queue
+        self.cost_unit = cost_unit
+        self.max_cost_penalty = max_cost_penalty
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="download")
+        self._seq = itertools.count()
+        self._waiting: List[_Ticket] = []
+        self._running = 0
+        self._running_by_kind: Counter = Counter()
+        self._running_by_user: Counter = Counter()
+        self._running_by_guild: Counter = Counter()
+        self._served_by_user: Counter = Counter()
+        self._served_by_guild: Counter = Counter()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiting)
+
+    @property
+    def active(self) -> int:
+        return self._running
+
+    def check_capacity(self):
+        if len(self._waiting) >= self.max_queue:
+            raise QueueFullError(f"Download queue is full ({self.max_queue} waiting), try again later")
+
+    def _can_start(self, ticket: _Ticket) -> bool:
+        if self._running >= self.max_concurrent:
+            return False
+        if self._running_by_kind[ticket.kind] >= self.kind_limits.get(ticket.kind, self.max_concurrent):
+            return False
+        if ticket.user_id is not None and self._running_by_user[ticket.user_id] >= self.max_per_user:
+            return False
+        if ticket.guild_id is not None and self._running_by_guild[ticket.guild_id] >= self.max_per_guild:
+            return False
+        return True
+
+    def _ordered(self) -> List[_Ticket]:
+        # Round-robin: a user's (and guild's) n-th waiting ticket goes after everyone's earlier turns
+        user_rounds, guild_rounds = Counter(self._served_by_user), Counter(self._served_by_guild)
+        keys = {}
+        for ticket in sorted(self._waiting, key=lambda t: t.seq):
+            keys[ticket] = (user_rounds[ticket.user_id], guild_rounds[ticket.guild_id],
+                            ticket.seq + min(ticket.cost / self.cost_unit, self.max_cost_penalty))
+            user_rounds[ticket.user_id] += 1
+            guild_rounds[ticket.guild_id] += 1
+        return sorted(self._waiting, key=keys.__getitem__)
+
+    def _start(self, ticket: _Ticket):
+        self._running += 1
+        self._running_by_kind[ticket.kind] += 1
+        self._running_by_user[ticket.user_id] += 1
+        self._running_by_guild[ticket.guild_id] += 1
+        self._served_by_user[ticket.user_id] += 1
+        self._served_by_guild[ticket.guild_id] += 1
+
+    def _forget_idle(self, ticket: _Ticket):
+        if not self._running_by_user[ticket.user_id] and all(t.user_id != ticket.user_id for t in self._waiting):
+            del self._served_by_user[ticket.user_id]
+        if not self._running_by_guild[ticket.guild_id] and all(t.guild_id != ticket.guild_id for t in self._waiting):
+            del self._served_by_guild[ticket.guild_id]
+
+    def _dispatch(self):
+        started = True
+        while started:
+            started = False
+            for ticket in self._ordered():
+                if self._can_start(ticket):
+                    self._waiting.remove(ticket)
+                    self._start(ticket)
+                    ticket.future.set_result(None)
+                    started = True
+                    break
+
+        for position, ticket in enumerate(self._ordered(), start=1):
+            if ticket.position != position:
+                ticket.position = position
+                if ticket.on_position:
+                    ticket.on_position(position)
+
+    async def acquire(self, kind: str, user_id: Optional[int] = None, guild_id: Optional[int] = None,
+                      on_position: Optional[Callable[[int], None]] = None, cost: int = 0) -> _Ticket:
+        ticket = _Ticket(next(self._seq), kind, user_id, guild_id, on_position, cost)
+
+        if not self._waiting and self._can_start(ticket):
+            self._start(ticket)
+            return ticket
+
+        self.check_capacity()
+
+        ticket.future = asyncio.get_running_loop().create_future()
+        self._waiting.append(ticket)
+        self._dispatch()
+
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+                self._forget_idle(ticket)
+                self._dispatch()
+            else:
+                self.release(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: _Ticket):
+        self._running -= 1
+        self._running_by_kind[ticket.kind] -= 1
+        self._running_by_user[ticket.user_id] -= 1
+        self._running_by_guild[ticket.guild_id] -= 1
+        self._forget_idle(ticket)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, kind: str, user_id: Optional[int] = None, guild_id: Optional[int] = None,
+                   on_position: Optional[Callable[[int], None]] = None, cost: int = 0):
+        ticket = await self.acquire(kind, user_id, guild_id, on_position, cost)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,120 @@
+import copy
+import queue
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import yt_dlp
+
+from progress import ProgressEvent
+
+
+class _Worker:
+    def __init__(self, params: Dict[str, Any]):
+        self.sink: Optional[Callable[[Tuple], None]] = None
+        self.cancel: Optional[threading.Event] = None
+        self.ydl = yt_dlp.YoutubeDL(params)
+        self.ydl.add_progress_hook(self._on_progress)
+        self.ydl.add_postprocessor_hook(self._on_postprocess)
+
+    def _check_cancel(self):
+        if self.cancel is not None and self.cancel.is_set():
+            raise yt_dlp.utils.DownloadCancelled("Download cancelled")
+
+    def _on_progress(self, d: Dict[str, Any]):
+        self._check_cancel()
+        if self.sink and d.get('status') == 'downloading':
+            self.sink(('progress', ProgressEvent.from_download(d)))
+
+    def _on_postprocess(self, d: Dict[str, Any]):
+        self._check_cancel()
+        if self.sink:
+            self.sink(('progress', ProgressEvent.from_postprocess(d)))
+
+
+class InProcessEngine:
+    def __init__(self, max_idle: int = 4, max_pools: int = 8):
+        self.max_idle = max_idle
+        self.max_pools = max_pools
+        self._idle: "OrderedDict[Tuple[str, ...], List[_Worker]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _params(args: list) -> Dict[str, Any]:
+        params = yt_dlp.parse_options(args).ydl_opts
+        params.update(quiet=True, noprogress=True)
+        return params
+
+    def _checkout(self, args: list) -> Tuple[Tuple[str, ...], _Worker]:
+        key = tuple(args)
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self._idle.move_to_end(key)
+                return key, idle.pop()
+        return key, _Worker(self._params(args))
+
+    def _checkin(self, key: Tuple[str, ...], worker: _Worker):
+        worker.sink = None
+        worker.cancel = None
+        evicted = []
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            self._idle.move_to_end(key)
+            if len(idle) < self.max_idle:
+                idle.append(worker)
+            else:
+                evicted.append(worker)
+            # Clip and per-height downloads each get their own args, so only the recent pools are kept
+            while len(self._idle) > self.max_pools:
+                evicted.extend(self._idle.popitem(last=False)[1])
+        for stale in evicted:
+            stale.ydl.close()
+
+    def warm(self, args: list):
+        key, worker = self._checkout(args)
+        _ = worker.ydl.cookiejar
+        self._checkin(key, worker)
+
+    def probe(self, url: str, args: list) -> Dict[str, Any]:
+        key, worker = self._checkout(args)
+        try:
+            return worker.ydl.sanitize_info(worker.ydl.extract_info(url, download=False))
+        finally:
+            self._checkin(key, worker)
+
+    def download_with_progress(self, url: str, args: list, probed: Optional[Dict[str, Any]] = None,
+                               cancel: Optional[threading.Event] = None):
+        key, worker = self._checkout(args)
+        events: queue.Queue = queue.Queue()
+        worker.sink = events.put
+        worker.cancel = cancel
+
+        def extract():
+            if probed:
+                try:
+                    return worker.ydl.process_ie_result(copy.deepcopy(probed), download=True)
+                except yt_dlp.utils.DownloadError:
+                    pass
+            return worker.ydl.extract_info(url, download=True)
+
+        def run():
+            try:
+                info = extract()
+                if info is None:
+                    events.put(('error', "Download failed", None))
+                else:
+                    events.put(('done', worker.ydl.sanitize_info(info)))
+            except Exception as e:
+                events.put(('error', str(e), None))
+            finally:
+                events.put(None)
+
+        thread = threading.Thread(target=run, name="ytdlp-inprocess", daemon=True)
+        thread.start()
+        try:
+            while (update := events.get()) is not None:
+                yield update
+        finally:
+            thread.join()
+            self._checkin(key, worker)